@@ -1,11 +1,37 @@
+import os
+import sys
+import asyncio
+import json
+import mmap
+import zlib
+import struct
 import uuid
+import time
+import itertools
+import functools
+import bisect
+import heapq
+import threading
+import gc
+import math
+import operator
 import random
+import argparse
+import contextlib
+import csv
+import io
+import signal
+import multiprocessing
+import platform
+from array import array
 from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 class Pelicula:
-    def __init__(self, titulo, genero, duracion, clasificacion, coleccionable=None, precio_coleccionable=0):
+    def __init__(self, titulo, genero, duracion, clasificacion, coleccionable=None, precio_coleccionable=0, precio_boleto=0):
         self.titulo, self.genero, self.duracion, self.clasificacion = titulo, genero, duracion, clasificacion
+        self.precio_boleto = precio_boleto  # Precio por asiento
         self.horarios = []  # Lista de tuplas (horario: datetime, sala: Sala)
         self.coleccionable = coleccionable  # Nombre del coleccionable
         self.precio_coleccionable = precio_coleccionable  # Precio extra o 0 si es gratis
@@ -18,55 +44,313 @@ class Pelicula:
         return info
 
     def agregar_horario(self, horario, sala):
+        sala.agregar_horario(horario, self.duracion)
         self.horarios.append((horario, sala))
-        sala.agregar_horario(horario)
 
-    def get_alternative_horarios(self, current_horario):
-        return sorted([(h, s.get_occupancy(h)) for h, s in self.horarios if h != current_horario], key=lambda x: x[1])
+    def get_alternative_horarios(self, current_horario, k=None):
+        alternativas = ((h, s.get_occupancy(h)) for h, s in self.horarios if h != current_horario)
+        if k is None:
+            return sorted(alternativas, key=lambda x: x[1])
+        return heapq.nsmallest(k, alternativas, key=lambda x: x[1])
+
+LIBRE, OCUPADO, RETENIDO = 0, 1, 2  # Estados de asiento en el mapa de una función
 
 class Sala:
-    def __init__(self, numero, filas=5, columnas=10):
+    def __init__(self, numero, filas=5, columnas=10, complejo=None, limpieza=0):
         self.numero, self.filas, self.columnas = numero, filas, columnas
-        self.horarios_asientos = {}  # horario -> {asiento: ocupado}
+        self.complejo = complejo  # Complejo de la cadena al que pertenece la sala
+        self.limpieza = limpieza  # Minutos de limpieza después de cada función
+        self._agenda = []  # [(inicio, fin con limpieza)] ordenada por inicio y sin solapamientos
+        self.horarios_asientos = {}  # horario -> bytearray (1 byte por asiento: LIBRE/OCUPADO/RETENIDO) o None hasta el primer uso
+        self.ocupados = {}  # horario -> número de asientos ocupados
+        self._precarga = {}  # horario -> semilla de la ocupación sintética, que se materializa con el mapa
+        self._candados = {}  # horario -> Lock, uno por función
+        self._por_etiqueta = {}  # "A1" -> 0; la primera etiqueta que falta carga la sala completa
+        self._etiquetas_completas = False
+        self._tramos = {}  # horario -> por fila, (tramo libre más largo, [(inicio, largo)]) o None si hay que recalcularla
+        self.versiones = {}  # horario -> versión del mapa, sube con cada cambio de asientos (0 si nunca cambió)
+        self._observadores = []  # observador(sala, horario) tras cada cambio de una función
+        # Filas de mejor a peor: las de un poco más atrás del centro primero
+        self._fila_ideal = (filas - 1) * 0.6
+        self._orden_filas = sorted(range(filas), key=lambda f: abs(f - self._fila_ideal))
+
+    def choque(self, horario, duracion=0):
+        # Como la agenda no tiene solapamientos, solo pueden chocar la función anterior y la siguiente: O(log n)
+        fin = horario + timedelta(minutes=duracion + self.limpieza)
+        i = bisect.bisect_left(self._agenda, (horario,))
+        if i and self._agenda[i - 1][1] > horario:
+            return self._agenda[i - 1]
+        if i < len(self._agenda) and self._agenda[i][0] < fin:
+            return self._agenda[i]
+        return None
+
+    def agregar_horario(self, horario, duracion=0):
+        if horario in self.horarios_asientos:
+            raise ValueError(f"La sala {self.numero} ya tiene una función a las {horario:%H:%M}.")
+        if choque := self.choque(horario, duracion):
+            raise ValueError(f"La función se superpone con la de las {choque[0]:%H:%M} en la sala {self.numero} (incluida la limpieza).")
+        intervalo = (horario, horario + timedelta(minutes=duracion + self.limpieza))
+        if not self._agenda or self._agenda[-1] < intervalo:
+            self._agenda.append(intervalo)
+        else:
+            bisect.insort(self._agenda, intervalo)
+        self.horarios_asientos[horario] = None
+        self.ocupados[horario] = 0
+        self._tramos.pop(horario, None)
+        self._precarga.pop(horario, None)
+        self._notificar(horario)
 
-    def agregar_horario(self, horario):
-        self.horarios_asientos[horario] = {f"{chr(65 + i)}{j + 1}": False for i in range(self.filas) for j in range(self.columnas)}
+    def precargar(self, horario, cantidad, semilla):
+        # Ocupación sintética perezosa: el contador queda al día y los asientos se eligen al crear el mapa
+        if horario not in self.horarios_asientos:
+            raise ValueError("No hay función en este horario.")
+        if self.horarios_asientos[horario] is not None or self.ocupados[horario]:
+            raise ValueError("Solo se puede precargar una función sin asientos ocupados.")
+        with self.candado(horario):
+            self.ocupados[horario] = min(cantidad, self.filas * self.columnas)
+            self._precarga[horario] = semilla
+            self._cambio(horario)
+        self._notificar(horario)
+
+    def suscribir(self, observador):
+        if observador not in self._observadores:
+            self._observadores.append(observador)
+
+    def _notificar(self, horario):
+        # Siempre fuera del candado de la función, para que un observador pueda volver a operar sobre la sala
+        for observador in self._observadores:
+            observador(self, horario)
+
+    def candado(self, horario):
+        return self._candados.get(horario) or self._candados.setdefault(horario, threading.Lock())
+
+    @staticmethod
+    def nombre_fila(fila):
+        # A..Z y luego AA, AB... para salas de más de 26 filas
+        return chr(65 + fila) if fila < 26 else chr(64 + fila // 26) + chr(65 + fila % 26)
+
+    def indice(self, asiento):
+        if (idx := self._por_etiqueta.get(asiento)) is not None:
+            return idx
+        if not self._etiquetas_completas:
+            # Una pasada por toda la sala, compartida por todos sus horarios, en vez de interpretar etiqueta por etiqueta
+            nombres = [self.nombre_fila(fila) for fila in range(self.filas)]
+            self._por_etiqueta.update((f"{nombre}{columna + 1}", fila * self.columnas + columna)
+                                      for fila, nombre in enumerate(nombres) for columna in range(self.columnas))
+            self._etiquetas_completas = True
+            if (idx := self._por_etiqueta.get(asiento)) is not None:
+                return idx
+        # Otras escrituras de una etiqueta válida, como "A01"
+        letras = asiento.rstrip("0123456789")
+        numero = asiento[len(letras):]
+        if len(letras) == 1:
+            fila = ord(letras) - 65
+        elif len(letras) == 2 and letras.isalpha():
+            fila = (ord(letras[0]) - 64) * 26 + ord(letras[1]) - 65
+        else:
+            fila = -1
+        if not (0 <= fila < self.filas and numero.isdigit() and 1 <= int(numero) <= self.columnas):
+            raise ValueError(f"Asiento {asiento} inválido.")
+        idx = self._por_etiqueta[asiento] = fila * self.columnas + int(numero) - 1
+        return idx
+
+    def etiqueta(self, indice):
+        return f"{self.nombre_fila(indice // self.columnas)}{indice % self.columnas + 1}"
+
+    def _mapa(self, horario):
+        if horario not in self.horarios_asientos:
+            raise ValueError("No hay función en este horario.")
+        if (mapa := self.horarios_asientos[horario]) is None:
+            mapa = bytearray(self.filas * self.columnas)
+            if (semilla := self._precarga.pop(horario, None)) is not None:
+                for idx in random.Random(semilla).sample(range(len(mapa)), self.ocupados[horario]):
+                    mapa[idx] = OCUPADO
+            self.horarios_asientos[horario] = mapa
+        return mapa
+
+    def mapa_asientos(self, horario):
+        with self.candado(horario):
+            return bytes(self._mapa(horario))
 
     def mostrar_asientos(self, horario):
         if horario not in self.horarios_asientos:
             raise ValueError("No hay función en este horario.")
+        mapa = self.mapa_asientos(horario)
         print(f"Asientos para horario {horario} en sala {self.numero}:")
         for i in range(self.filas):
-            print(f"{chr(65 + i)} {' '.join('[X]' if self.horarios_asientos[horario][f'{chr(65 + i)}{j + 1}'] else '[ ]' for j in range(self.columnas))}")
+            fila = mapa[i * self.columnas:(i + 1) * self.columnas]
+            print(f"{self.nombre_fila(i)} {' '.join('[X]' if ocupado else '[ ]' for ocupado in fila)}")
 
-    def ocupar_asientos(self, horario, asientos):
-        if horario not in self.horarios_asientos:
-            raise ValueError("No hay función en este horario.")
+    def _indices(self, asientos):
+        indices = []
         for asiento in asientos:
-            if asiento not in self.horarios_asientos[horario] or self.horarios_asientos[horario][asiento]:
-                raise ValueError(f"Asiento {asiento} inválido o ya ocupado.")
-            self.horarios_asientos[horario][asiento] = True
+            try:
+                indices.append(self.indice(asiento))
+            except ValueError:
+                raise ValueError(f"Asiento {asiento} inválido o ya ocupado.") from None
+        if len(set(indices)) != len(indices):
+            raise ValueError("Asientos repetidos en la misma compra.")
+        return indices
+
+    def ocupar_asientos(self, horario, asientos, estado=OCUPADO):
+        indices = self._indices(asientos)
+        with self.candado(horario):
+            mapa = self._mapa(horario)
+            # Todo o nada: se valida el grupo completo antes de marcar un solo asiento
+            for asiento, idx in zip(asientos, indices):
+                if mapa[idx]:
+                    raise ValueError(f"Asiento {asiento} inválido o ya ocupado.")
+            for idx in indices:
+                mapa[idx] = estado
+            self.ocupados[horario] += len(indices)
+            self._cambio(horario, indices)
+        self._notificar(horario)
+
+    def ocupar_lote(self, horario, pedidos):
+        # Un solo paso bajo el candado de la función; devuelve por pedido sus índices o el ValueError que lo rechazó
+        resultados, etiquetas = [], self._por_etiqueta
+        for asientos in pedidos:
+            if not asientos:
+                resultados.append(ValueError("Hay que elegir al menos un asiento."))
+                continue
+            indices = [etiquetas.get(asiento) for asiento in asientos]
+            # Etiquetas ya vistas y sin repetir: el caso común no pasa por _indices
+            if None in indices or (len(indices) > 1 and len(set(indices)) != len(indices)):
+                try:
+                    indices = self._indices(asientos)
+                except ValueError as e:
+                    indices = e
+            resultados.append(indices)
+        with self.candado(horario):
+            mapa, tomados = self._mapa(horario), set()
+            for i, indices in enumerate(resultados):
+                if isinstance(indices, ValueError):
+                    continue
+                for idx in indices:
+                    if mapa[idx] or idx in tomados:
+                        resultados[i] = ValueError(f"Asiento {self.etiqueta(idx)} inválido o ya ocupado.")
+                        break
+                else:
+                    tomados.update(indices)
+            for idx in tomados:
+                mapa[idx] = OCUPADO
+            self.ocupados[horario] += len(tomados)
+            self._cambio(horario, tomados)
+        self._notificar(horario)
+        return resultados
+
+    def retener_asientos(self, horario, asientos):
+        self.ocupar_asientos(horario, asientos, RETENIDO)
+
+    def confirmar_asientos(self, horario, asientos):
+        indices = self._indices(asientos)
+        with self.candado(horario):
+            mapa = self._mapa(horario)
+            if any(mapa[idx] != RETENIDO for idx in indices):
+                raise ValueError("Los asientos no están retenidos.")
+            for idx in indices:
+                mapa[idx] = OCUPADO
+            self._cambio(horario)
+        self._notificar(horario)
 
     def liberar_asientos(self, horario, asientos):
+        indices = [self.indice(asiento) for asiento in asientos]
+        with self.candado(horario):
+            mapa = self._mapa(horario)
+            for idx in indices:
+                if mapa[idx]:
+                    mapa[idx] = 0
+                    self.ocupados[horario] -= 1
+            self._cambio(horario, indices)
+        self._notificar(horario)
+
+    def restaurar_asientos(self, horario, indices, estado=OCUPADO):
+        # Para recuperación: marca o libera por índice sin validar conflictos
+        with self.candado(horario):
+            mapa = self._mapa(horario)
+            for idx in indices:
+                self.ocupados[horario] += (estado != LIBRE) - (mapa[idx] != LIBRE)
+                mapa[idx] = estado
+            self._cambio(horario, indices)
+        self._notificar(horario)
+
+    def _cambio(self, horario, indices=()):
+        # Bajo el candado de la función: sube su versión e invalida los tramos de las filas tocadas
+        self.versiones[horario] = self.versiones.get(horario, 0) + 1
+        if tramos := self._tramos.get(horario):
+            for idx in indices:
+                tramos[idx // self.columnas] = None
+
+    def _tramos_fila(self, horario, fila):
+        tramos = self._tramos.get(horario) or self._tramos.setdefault(horario, [None] * self.filas)
+        if (cache := tramos[fila]) is None:
+            mapa, libres, inicio = self._mapa(horario), [], None
+            for col in range(self.columnas + 1):
+                if col < self.columnas and not mapa[fila * self.columnas + col]:
+                    inicio = col if inicio is None else inicio
+                elif inicio is not None:
+                    libres.append((inicio, col - inicio))
+                    inicio = None
+            cache = tramos[fila] = (max((largo for _, largo in libres), default=0), libres)
+        return cache
+
+    def _mejor_bloque(self, tramos_por_fila, n):
+        # Menor costo: distancia a la fila ideal (pesa doble) más distancia del centro del bloque al centro de la fila
+        centro, mejor = (self.columnas - 1) / 2, None
+        for fila in self._orden_filas:
+            costo_fila = 2 * abs(fila - self._fila_ideal)
+            if mejor and costo_fila >= mejor[0]:
+                break
+            maximo, libres = tramos_por_fila(fila)
+            if maximo < n:
+                continue
+            for inicio, largo in libres:
+                if largo >= n:
+                    col = min(max(round(centro - (n - 1) / 2), inicio), inicio + largo - n)
+                    costo = costo_fila + abs(col + (n - 1) / 2 - centro)
+                    if not mejor or costo < mejor[0]:
+                        mejor = (costo, fila, col)
+        return mejor
+
+    def mejores_asientos(self, horario, n):
         if horario not in self.horarios_asientos:
             raise ValueError("No hay función en este horario.")
-        for asiento in asientos:
-            self.horarios_asientos[horario][asiento] = False
+        if n < 1 or self.filas * self.columnas - self.ocupados[horario] < n:
+            raise ValueError("No hay suficientes asientos libres.")
+        with self.candado(horario):
+            if mejor := self._mejor_bloque(lambda fila: self._tramos_fila(horario, fila), n):
+                _, fila, col = mejor
+                return [self.etiqueta(fila * self.columnas + c) for c in range(col, col + n)]
+            # Sin bloque contiguo: se reparte el grupo en los bloques más grandes posibles, cerca de la fila ideal
+            copia = {fila: list(self._tramos_fila(horario, fila)[1]) for fila in range(self.filas)}
+            elegidos = []
+            while (restantes := n - len(elegidos)) > 0:
+                k = min(restantes, max(largo for libres in copia.values() for _, largo in libres))
+                _, fila, col = self._mejor_bloque(lambda f: (max((l for _, l in copia[f]), default=0), copia[f]), k)
+                elegidos.extend(self.etiqueta(fila * self.columnas + c) for c in range(col, col + k))
+                i, (inicio, largo) = next((i, t) for i, t in enumerate(copia[fila]) if t[0] <= col < t[0] + t[1])
+                copia[fila][i:i + 1] = [t for t in ((inicio, col - inicio), (col + k, inicio + largo - col - k)) if t[1]]
+            return elegidos
 
     def get_occupancy(self, horario):
-        if horario not in self.horarios_asientos:
-            return 0
-        asientos = self.horarios_asientos[horario]
-        return (sum(asientos.values()) / len(asientos)) * 100 if asientos else 0
+        total = self.filas * self.columnas
+        return (self.ocupados.get(horario, 0) / total) * 100 if total else 0
 
     def is_full(self, horario):
-        return self.get_occupancy(horario) >= 100
+        return (total := self.filas * self.columnas) > 0 and self.ocupados.get(horario, 0) >= total
 
 class Boleto:
-    def __init__(self, codigo, pelicula, horario, asientos, cliente, coleccionable=None, precio_extra=0):
+    __slots__ = ("codigo", "pelicula", "horario", "asientos", "cliente", "coleccionable", "precio_extra", "precio_boleto")
+
+    def __init__(self, codigo, pelicula, horario, asientos, cliente, coleccionable=None, precio_extra=0, precio_boleto=0):
         self.codigo, self.pelicula, self.horario, self.asientos, self.cliente = codigo, pelicula, horario, asientos, cliente
         self.coleccionable = coleccionable
         self.precio_extra = precio_extra
+        self.precio_boleto = precio_boleto
+
+    @property
+    def total(self):
+        return len(self.asientos) * self.precio_boleto + self.precio_extra
 
     def mostrar_detalles(self):
         detalles = f"Boleto {self.codigo}: {self.pelicula.titulo} at {self.horario}, asientos: {', '.join(self.asientos)} for {self.cliente.nombre}"
@@ -74,62 +358,1475 @@ class Boleto:
             detalles += f" + Coleccionable: {self.coleccionable} (${self.precio_extra})"
         return detalles
 
+class VistaBoleto:
+    # Boleto de una fila del libro que se arma recién cuando se lee algo más que el código
+    __slots__ = ("libro", "fila", "_boleto")
+
+    def __init__(self, libro, fila):
+        self.libro, self.fila, self._boleto = libro, fila, None
+
+    @property
+    def codigo(self):
+        return f"{self.libro.codigos[self.fila]:08X}"
+
+    def __getattr__(self, nombre):
+        # Solo llega acá lo que no es un slot ni una propiedad
+        if self._boleto is None:
+            self._boleto = self.libro.boleto(self.fila)
+        return getattr(self._boleto, nombre)
+
+class Funcion:
+    __slots__ = ("id", "pelicula", "horario", "sala")
+
+    def __init__(self, id_funcion, pelicula, horario, sala):
+        self.id, self.pelicula, self.horario, self.sala = id_funcion, pelicula, horario, sala
+
+    def __repr__(self):
+        return f"Funcion({self.id}, {self.pelicula.titulo!r}, {self.horario}, sala {self.sala.numero})"
+
+class RegistroFunciones:
+    def __init__(self):
+        self.por_id = {}  # id -> Funcion
+        self.por_clave = {}  # (pelicula, horario) -> Funcion
+        self.por_sala = defaultdict(list)  # sala -> [(horario, id)] ordenada por horario
+        self.por_pelicula = defaultdict(list)  # pelicula -> [(horario, id)] ordenada por horario
+        self.por_similitud = defaultdict(list)  # (genero, clasificacion) -> [(horario, id)] ordenada por horario
+        self.por_tiempo = []  # [(horario, id)] ordenada por horario
+        self._siguiente_id = 1
+
+    def __len__(self):
+        return len(self.por_id)
+
+    def __iter__(self):
+        return iter(self.por_id.values())
+
+    def registrar(self, pelicula, horario, sala, id_funcion=None):
+        if funcion := self.por_clave.get((pelicula, horario)):
+            return funcion
+        if id_funcion is None:
+            id_funcion = self._siguiente_id
+        elif id_funcion in self.por_id:
+            raise ValueError(f"Función {id_funcion} duplicada.")
+        self._siguiente_id = max(self._siguiente_id, id_funcion + 1)
+        funcion = self.por_id[id_funcion] = self.por_clave[(pelicula, horario)] = Funcion(id_funcion, pelicula, horario, sala)
+        entrada = (horario, id_funcion)  # la misma tupla en todos los índices
+        for indice in (self.por_sala[sala], self.por_pelicula[pelicula],
+                       self.por_similitud[(pelicula.genero, pelicula.clasificacion)], self.por_tiempo):
+            # Las funciones suelen llegar en orden de horario: agregar al final evita la búsqueda binaria
+            if not indice or indice[-1] < entrada:
+                indice.append(entrada)
+            else:
+                bisect.insort(indice, entrada)
+        return funcion
+
+    def obtener(self, id_funcion):
+        return self.por_id.get(id_funcion)
+
+    def buscar(self, pelicula, horario):
+        return self.por_clave.get((pelicula, horario))
+
+    def _rango(self, indice, inicio, fin):
+        desde = bisect.bisect_left(indice, (inicio or datetime.min,))
+        hasta = bisect.bisect_right(indice, (fin or datetime.max, float("inf")))
+        return [self.por_id[i] for _, i in indice[desde:hasta]]
+
+    def en_ventana(self, inicio=None, fin=None):
+        return self._rango(self.por_tiempo, inicio, fin)
+
+    def de_sala(self, sala, inicio=None, fin=None):
+        return self._rango(self.por_sala.get(sala, []), inicio, fin)
+
+    def de_pelicula(self, pelicula, inicio=None, fin=None):
+        return self._rango(self.por_pelicula.get(pelicula, []), inicio, fin)
+
+    def similares(self, pelicula, inicio=None, fin=None):
+        # Funciones de películas del mismo género y clasificación, incluida la propia
+        return self._rango(self.por_similitud.get((pelicula.genero, pelicula.clasificacion), []), inicio, fin)
+
+class Cubeta:
+    def __init__(self):
+        self.por_funcion = defaultdict(lambda: [0, 0, 0, 0, 0])  # Funcion -> [boletos, asientos, ingresos, con coleccionable, ingresos por coleccionable]
+        self.por_pelicula = defaultdict(int)  # titulo -> asientos
+        self.por_sala = defaultdict(int)  # numero de sala -> asientos
+        self.boletos = self.ingresos = 0
+
+class ReporteIncremental:
+    def __init__(self, granularidad=timedelta(hours=1)):
+        self.granularidad = granularidad
+        self.cubetas = {}  # inicio de cubeta -> Cubeta
+        self._inicios = []  # inicios de cubeta ordenados
+        self._candado = threading.Lock()
+
+    def _inicio_cubeta(self, horario):
+        return datetime.min + (horario - datetime.min) // self.granularidad * self.granularidad
+
+    def registrar(self, funcion, boleto, signo=1):
+        with self._candado:
+            self._registrar(funcion, signo, signo * len(boleto.asientos), signo * boleto.total,
+                            signo * (boleto.coleccionable is not None), signo * boleto.precio_extra)
+
+    def registrar_lote(self, funcion, boletos, asientos, ingresos, coleccionables=0, extras=0):
+        # Totales ya sumados de un lote de la misma función
+        with self._candado:
+            self._registrar(funcion, boletos, asientos, ingresos, coleccionables, extras)
+
+    def _registrar(self, funcion, boletos, asientos, ingresos, coleccionables=0, extras=0):
+        inicio = self._inicio_cubeta(funcion.horario)
+        if not (cubeta := self.cubetas.get(inicio)):
+            cubeta = self.cubetas[inicio] = Cubeta()
+            bisect.insort(self._inicios, inicio)
+        totales = cubeta.por_funcion[funcion]
+        totales[0] += boletos
+        totales[1] += asientos
+        totales[2] += ingresos
+        totales[3] += coleccionables
+        totales[4] += extras
+        cubeta.por_pelicula[funcion.pelicula.titulo] += asientos
+        cubeta.por_sala[funcion.sala.numero] += asientos
+        cubeta.boletos += boletos
+        cubeta.ingresos += ingresos
+        if not totales[0]:
+            del cubeta.por_funcion[funcion]
+        for indice, clave in ((cubeta.por_pelicula, funcion.pelicula.titulo), (cubeta.por_sala, funcion.sala.numero)):
+            if not indice[clave]:
+                del indice[clave]
+        if not cubeta.boletos:
+            del self.cubetas[inicio]
+            del self._inicios[bisect.bisect_left(self._inicios, inicio)]
+
+    def _cubetas(self, inicio, fin):
+        desde = bisect.bisect_left(self._inicios, self._inicio_cubeta(inicio) if inicio > datetime.min else inicio)
+        hasta = bisect.bisect_right(self._inicios, fin)
+        for clave in self._inicios[desde:hasta]:
+            # Una cubeta en el borde del rango se filtra función por función
+            completa = clave >= inicio and fin - clave >= self.granularidad
+            yield clave, self.cubetas[clave], completa
+
+    def consultar(self, inicio, fin):
+        with self._candado:
+            return self._consultar(inicio, fin)
+
+    def _consultar(self, inicio, fin):
+        vistas, concurrencia, total_por_sala = defaultdict(int), defaultdict(int), defaultdict(int)
+        boletos = 0
+        for _, cubeta, completa in self._cubetas(inicio, fin):
+            if completa:
+                boletos += cubeta.boletos
+                for titulo, c in cubeta.por_pelicula.items():
+                    vistas[titulo] += c
+                for sala, c in cubeta.por_sala.items():
+                    total_por_sala[sala] += c
+            for funcion, (b, c, *_) in cubeta.por_funcion.items():
+                if completa:
+                    concurrencia[(funcion.pelicula.titulo, funcion.horario)] += c
+                elif inicio <= funcion.horario <= fin:
+                    boletos += b
+                    vistas[funcion.pelicula.titulo] += c
+                    concurrencia[(funcion.pelicula.titulo, funcion.horario)] += c
+                    total_por_sala[funcion.sala.numero] += c
+        return boletos, vistas, concurrencia, total_por_sala
+
+    def ingresos(self, inicio, fin, por=timedelta(days=1)):
+        with self._candado:
+            return self._ingresos(inicio, fin, por)
+
+    def por_funcion(self, inicio, fin):
+        # Funcion -> (boletos, asientos, ingresos, con coleccionable, ingresos por coleccionable) de las funciones del rango
+        with self._candado:
+            return {funcion: tuple(totales) for _, cubeta, completa in self._cubetas(inicio, fin)
+                    for funcion, totales in cubeta.por_funcion.items() if completa or inicio <= funcion.horario <= fin}
+
+    def _ingresos(self, inicio, fin, por):
+        resultado = defaultdict(int)
+        for clave, cubeta, completa in self._cubetas(inicio, fin):
+            grupo = datetime.min + (clave - datetime.min) // por * por
+            if completa:
+                resultado[grupo] += cubeta.ingresos
+            else:
+                for funcion, (_, _, ingresos, *_) in cubeta.por_funcion.items():
+                    if inicio <= funcion.horario <= fin:
+                        resultado[grupo] += ingresos
+        return dict(resultado)
+
+class RuedaTemporizadora:
+    def __init__(self, resolucion=1.0, ranuras=512, ahora=None):
+        self.resolucion = resolucion
+        self.ranuras = [[] for _ in range(ranuras)]  # cada ranura: [(tick de vencimiento, clave)]
+        self._tick = self._a_tick(time.monotonic() if ahora is None else ahora)
+        self._candado = threading.Lock()
+
+    def _a_tick(self, instante):
+        return int(instante // self.resolucion)
+
+    def agregar(self, clave, vence):
+        with self._candado:
+            tick = max(-self._a_tick(-vence), self._tick + 1)  # redondeo hacia arriba: nunca vence antes de tiempo
+            self.ranuras[tick % len(self.ranuras)].append((tick, clave))
+
+    def avanzar(self, ahora):
+        actual = self._a_tick(ahora)
+        if actual <= self._tick:
+            return []
+        vencidas = []
+        with self._candado:
+            # Cada ranura se recorre a lo sumo una vez por avance, aunque hayan pasado varias vueltas
+            for tick in range(self._tick + 1, min(actual, self._tick + len(self.ranuras)) + 1):
+                ranura = self.ranuras[tick % len(self.ranuras)]
+                if ranura:
+                    pendientes = [e for e in ranura if e[0] > actual]
+                    vencidas.extend(clave for t, clave in ranura if t <= actual)
+                    ranura[:] = pendientes
+            self._tick = max(self._tick, actual)
+        return vencidas
+
+SALA, PELICULA, FUNCION, VENTA, CANCELACION, INVENTARIO = 1, 2, 3, 4, 5, 6  # Tipos de registro de la bitácora
+_CABECERA = struct.Struct("<BII")  # tipo, largo del contenido, crc32 del contenido
+_VENTA = struct.Struct("<8sIddBH")  # codigo, funcion, precio_extra, precio_boleto, coleccionable (2 = descontado de un contador), cantidad de asientos
+_CANCELACION = struct.Struct("<8sIH")  # codigo, funcion, cantidad de asientos
+_TEXTO = struct.Struct("<H")
+
+def _codificar_texto(texto):
+    datos = texto.encode()
+    return _TEXTO.pack(len(datos)) + datos
+
+def _leer_texto(datos, pos):
+    largo, = _TEXTO.unpack_from(datos, pos)
+    pos += _TEXTO.size
+    return bytes(datos[pos:pos + largo]).decode(), pos + largo
+
+def _codificar_venta(codigo, id_funcion, precio_extra, precio_boleto, coleccionable, indices, cliente, textos=None):
+    # textos: caché Cliente -> nombre y correo ya codificados, para lotes en que el mismo cliente se repite
+    if textos is None or (texto := textos.get(cliente)) is None:
+        texto = _codificar_texto(cliente.nombre) + _codificar_texto(cliente.correo)
+        if textos is not None:
+            textos[cliente] = texto
+    return (_VENTA.pack(codigo.encode(), id_funcion, precio_extra, precio_boleto, int(coleccionable), len(indices))
+            + struct.pack(f"<{len(indices)}H", *indices) + texto)
+
+def _decodificar_venta(datos, pos=0):
+    codigo, id_funcion, precio_extra, precio_boleto, coleccionable, n = _VENTA.unpack_from(datos, pos)
+    pos += _VENTA.size
+    indices = struct.unpack_from(f"<{n}H", datos, pos)
+    nombre, pos = _leer_texto(datos, pos + 2 * n)
+    correo, pos = _leer_texto(datos, pos)
+    return (codigo.decode(), id_funcion, precio_extra, precio_boleto, coleccionable, indices, nombre, correo), pos
+
+class Bitacora:
+    def __init__(self, directorio, segmento=0, lote=256, intervalo=0.05):
+        self.directorio, self.segmento = directorio, segmento
+        self.lote, self.intervalo = lote, intervalo  # fsync cada `lote` registros o cada `intervalo` segundos
+        self._pendiente, self._registros = bytearray(), 0
+        self._candado = threading.Lock()
+        self._detener = threading.Event()
+        os.makedirs(directorio, exist_ok=True)
+        self._archivo = open(self.ruta_segmento(directorio, segmento), "ab")
+        self._hilo = threading.Thread(target=self._vaciar_periodicamente, daemon=True)
+        self._hilo.start()
+
+    @staticmethod
+    def ruta_segmento(directorio, segmento):
+        return os.path.join(directorio, f"bitacora-{segmento:06d}.bin")
+
+    @staticmethod
+    def segmentos(directorio):
+        return sorted(int(n[9:15]) for n in os.listdir(directorio) if n.startswith("bitacora-") and n.endswith(".bin"))
+
+    def escribir(self, tipo, contenido):
+        self.escribir_varios(tipo, [contenido])
+
+    def escribir_varios(self, tipo, contenidos):
+        registros = b"".join(_CABECERA.pack(tipo, len(c), zlib.crc32(c)) + c for c in contenidos)
+        with self._candado:
+            self._pendiente += registros
+            self._registros += len(contenidos)
+            if self._registros >= self.lote:
+                self._vaciar()
+
+    def _vaciar(self):
+        if self._pendiente:
+            self._archivo.write(self._pendiente)
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+            self._pendiente.clear()
+            self._registros = 0
+
+    def _vaciar_periodicamente(self):
+        while not self._detener.wait(self.intervalo):
+            with self._candado:
+                self._vaciar()
+
+    def sincronizar(self):
+        with self._candado:
+            self._vaciar()
+
+    def rotar(self):
+        with self._candado:
+            return self._rotar()
+
+    def _rotar(self):
+        # Cierra el segmento actual y abre el siguiente; la instantánea guarda desde qué segmento reproducir
+        self._vaciar()
+        self._archivo.close()
+        self.segmento += 1
+        self._archivo = open(self.ruta_segmento(self.directorio, self.segmento), "ab")
+        return self.segmento
+
+    def cerrar(self):
+        self._detener.set()
+        self._hilo.join()
+        with self._candado:
+            self._vaciar()
+            self._archivo.close()
+
+    @staticmethod
+    def leer(ruta):
+        # Devuelve (tipo, contenido) hasta el primer registro incompleto o corrupto, y trunca ahí el archivo
+        with open(ruta, "rb") as f:
+            datos = f.read()
+        pos = 0
+        while pos + _CABECERA.size <= len(datos):
+            tipo, largo, crc = _CABECERA.unpack_from(datos, pos)
+            contenido = datos[pos + _CABECERA.size:pos + _CABECERA.size + largo]
+            if len(contenido) < largo or zlib.crc32(contenido) != crc:
+                break
+            yield tipo, contenido
+            pos += _CABECERA.size + largo
+        if pos < len(datos):
+            with open(ruta, "r+b") as f:
+                f.truncate(pos)
+
+class Compuerta:
+    # Operaciones que anotan en la bitácora y cambian el estado en memoria en dos pasos: muchas pueden estar adentro
+    # a la vez, pero la instantánea espera a que no quede ninguna a medias y no deja entrar otras mientras copia.
+    # Es reentrante por hilo: un observador que corre dentro de una operación no espera a la instantánea pendiente.
+    def __init__(self):
+        self._condicion = threading.Condition()
+        self._dentro = 0
+        self._exclusiva = False
+        self._hilo = threading.local()
+
+    @contextlib.contextmanager
+    def compartida(self):
+        if getattr(self._hilo, "nivel", 0):
+            self._hilo.nivel += 1
+        else:
+            with self._condicion:
+                self._condicion.wait_for(lambda: not self._exclusiva)
+                self._dentro += 1
+            self._hilo.nivel = 1
+        try:
+            yield
+        finally:
+            self._hilo.nivel -= 1
+            if not self._hilo.nivel:
+                with self._condicion:
+                    self._dentro -= 1
+                    self._condicion.notify_all()
+
+    @contextlib.contextmanager
+    def exclusiva(self):
+        if getattr(self._hilo, "nivel", 0):
+            raise ValueError("No se puede guardar una instantánea en medio de una operación.")
+        with self._condicion:
+            self._condicion.wait_for(lambda: not self._exclusiva)
+            # Cerrada antes de esperar: las operaciones nuevas no pueden postergarla indefinidamente
+            self._exclusiva = True
+            self._condicion.wait_for(lambda: not self._dentro)
+        try:
+            yield
+        finally:
+            with self._condicion:
+                self._exclusiva = False
+                self._condicion.notify_all()
+
+_MAGIA = b"CINEIMG1"
+_VENTAS_MAGIA = b"CINEVTA1"  # exportación binaria del libro de ventas
+_INSTANTANEA = struct.Struct("<8sII")  # magia, segmento de bitácora desde el que se reproduce, largo del JSON
+_PRECARGA = struct.Struct("<QI")  # semilla y cantidad de una ocupación sintética aún sin materializar
+
+class Reserva:
+    def __init__(self, id_reserva, funcion, asientos, cliente, vence):
+        self.id, self.funcion, self.asientos, self.cliente, self.vence = id_reserva, funcion, asientos, cliente, vence
+
+class RepositorioBoletos:
+    # Libro de ventas por columnas: una fila por boleto en arreglos compactos, sin un objeto por venta.
+    # Boleto es solo una vista que se arma al pedirla; las filas canceladas quedan inactivas hasta la próxima recuperación.
+    def __init__(self, funciones):
+        self.funciones = funciones  # RegistroFunciones para resolver película, horario y sala de cada fila
+        self.codigos = array("I")  # código de 8 dígitos hexadecimales como entero
+        self.funcion = array("I")  # id de la función
+        self.sala = array("I")  # número de sala
+        self.cliente = array("I")  # id de cliente en self.clientes
+        self.coleccionable = bytearray()
+        self.existencia = array("H")  # contador del inventario del que salió el coleccionable, en self.existencias (0 = ninguno)
+        self.precio_extra = array("d")
+        self.precio_boleto = array("d")
+        self.inicio_asientos = array("I", [0])  # los asientos de la fila i son asientos[inicio_asientos[i]:inicio_asientos[i + 1]]
+        self.asientos = array("H")  # índices de asiento en el mapa de la sala
+        self.activo = bytearray()
+        self.clientes = []  # id -> Cliente
+        self._id_cliente = {}  # Cliente -> id
+        self.existencias = [None]  # id -> clave del contador en InventarioColeccionables
+        self.por_codigo = {}  # código (entero) -> fila, solo boletos activos
+        self.cancelados = {}  # código (entero) -> fila de los boletos cancelados; con por_codigo, todo lo emitido
+        self.por_funcion = defaultdict(lambda: array("I"))  # id de función -> filas, incluidas las inactivas
+        self.por_cliente = defaultdict(lambda: array("I"))  # id de cliente -> filas, incluidas las inactivas
+        self._candado = threading.Lock()
+
+    def __len__(self):
+        return len(self.por_codigo)
+
+    def __iter__(self):
+        return (self.boleto(fila) for fila in list(self.por_codigo.values()))
+
+    def __contains__(self, codigo):
+        return self.fila(codigo) is not None
+
+    @staticmethod
+    def _clave(codigo):
+        try:
+            return int(codigo, 16) if len(codigo) == 8 else None
+        except ValueError:
+            return None
+
+    def fila(self, codigo):
+        return self.por_codigo.get(self._clave(codigo))
+
+    def emitido(self, clave):
+        # Un código no se vuelve a emitir aunque su boleto se haya cancelado: el control de acceso y quien lo guardó
+        # lo seguirían tomando por el boleto viejo
+        return clave in self.por_codigo or clave in self.cancelados
+
+    def nuevo_codigo(self):
+        while self.emitido(int(codigo := uuid.uuid4().hex[:8].upper(), 16)):
+            pass
+        return codigo
+
+    def nuevas_claves(self, cantidad):
+        # Mismo espacio que uuid4().hex[:8] (32 bits aleatorios), ya como enteros y con una sola lectura de os.urandom
+        usadas, cancelados = self.por_codigo, self.cancelados
+        claves = {clave for clave in array("I", os.urandom(4 * cantidad)) if clave not in usadas and clave not in cancelados}
+        while len(claves) < cantidad:
+            claves.add(self._clave(self.nuevo_codigo()))
+        return list(claves)
+
+    def nuevos_codigos(self, cantidad):
+        return [f"{clave:08X}" for clave in self.nuevas_claves(cantidad)]
+
+    def _id(self, cliente):
+        if (id_cliente := self._id_cliente.get(cliente)) is None:
+            id_cliente = self._id_cliente[cliente] = len(self.clientes)
+            self.clientes.append(cliente)
+            cliente.libros.append(self)
+        return id_cliente
+
+    def _id_existencia(self, clave):
+        if clave is None:
+            return 0
+        if clave not in self.existencias:
+            self.existencias.append(clave)
+        return self.existencias.index(clave)
+
+    def agregar(self, funcion, codigo, indices, cliente, coleccionable=False, precio_extra=0, precio_boleto=0, existencia=None):
+        return self.agregar_lote(funcion, [(codigo, indices, cliente, coleccionable, precio_extra, precio_boleto, existencia)])[0]
+
+    def agregar_lote(self, funcion, ventas):
+        # ventas: (codigo, indices, cliente, coleccionable, precio_extra, precio_boleto, existencia), todas de la misma función
+        codigos, indices, clientes, coleccionables, extras, precios, existencias = zip(*ventas)
+        return self.agregar_columnas(funcion, [int(codigo, 16) for codigo in codigos], indices, clientes, coleccionables, extras, precios, existencias)
+
+    def agregar_columnas(self, funcion, claves, indices, clientes, coleccionables, extras, precios, existencias=None):
+        # Un lote de la misma función ya separado por columna: cada arreglo crece de una vez, sin recorrer fila por fila
+        n = len(claves)
+        with self._candado:
+            if not self.por_codigo.keys().isdisjoint(claves):
+                repetida = next(clave for clave in claves if clave in self.por_codigo)
+                raise ValueError(f"Código {repetida:08X} duplicado.")
+            desde, conocidos = len(self.codigos), self._id_cliente
+            ids = [conocidos.get(cliente) for cliente in clientes]
+            if None in ids:
+                ids = [self._id(cliente) for cliente in clientes]
+            self.codigos.extend(claves)
+            self.funcion.extend(array("I", [funcion.id]) * n)
+            self.sala.extend(array("I", [funcion.sala.numero]) * n)
+            self.cliente.extend(ids)
+            self.coleccionable.extend(map(bool, coleccionables))
+            self.existencia.extend(map(self._id_existencia, existencias) if existencias and any(existencias) else array("H", [0]) * n)
+            self.precio_extra.extend(extras)
+            self.precio_boleto.extend(precios)
+            self.asientos.extend(itertools.chain.from_iterable(indices))
+            self.inicio_asientos.extend(itertools.islice(itertools.accumulate(map(len, indices), initial=self.inicio_asientos[-1]), 1, None))
+            self.activo.extend(b"\x01" * n)
+            # Las filas quedan completas antes de publicarse en los índices: las lecturas no toman el candado
+            filas = range(desde, desde + n)
+            self.por_funcion[funcion.id].extend(filas)
+            por_cliente = self.por_cliente
+            for id_cliente, fila in zip(ids, filas):
+                por_cliente[id_cliente].append(fila)
+            self.por_codigo.update(zip(claves, filas))
+        return filas
+
+    def indices(self, fila):
+        return self.asientos[self.inicio_asientos[fila]:self.inicio_asientos[fila + 1]]
+
+    def boleto(self, fila):
+        funcion = self.funciones.obtener(self.funcion[fila])
+        pelicula, sala = funcion.pelicula, funcion.sala
+        return Boleto(f"{self.codigos[fila]:08X}", pelicula, funcion.horario, [sala.etiqueta(i) for i in self.indices(fila)],
+                      self.clientes[self.cliente[fila]], pelicula.coleccionable if self.coleccionable[fila] else None,
+                      self.precio_extra[fila], self.precio_boleto[fila])
+
+    def existencia_de(self, fila):
+        return self.existencias[self.existencia[fila]]
+
+    def buscar(self, codigo):
+        return None if (fila := self.fila(codigo)) is None else self.boleto(fila)
+
+    def eliminar(self, codigo):
+        with self._candado:
+            if (fila := self.por_codigo.pop(self._clave(codigo), None)) is None:
+                return None
+            self.activo[fila] = 0
+            self.cancelados[self.codigos[fila]] = fila
+        return self.boleto(fila)
+
+    def _vistas(self, filas):
+        return [self.boleto(fila) for fila in filas if self.activo[fila]]
+
+    def de_funcion(self, pelicula, horario):
+        funcion = self.funciones.buscar(pelicula, horario)
+        return self._vistas(self.por_funcion.get(funcion.id, ())) if funcion else []
+
+    def de_pelicula(self, pelicula):
+        return [b for f in self.funciones.de_pelicula(pelicula) for b in self._vistas(self.por_funcion.get(f.id, ()))]
+
+    def de_cliente(self, cliente):
+        id_cliente = self._id_cliente.get(cliente)
+        return self._vistas(self.por_cliente.get(id_cliente, ())) if id_cliente is not None else []
+
+    def exportar_csv(self, archivo, bloque=10000):
+        # Escribe los boletos activos de a `bloque` filas, sin armar la tabla completa en memoria
+        escritor = csv.writer(archivo)
+        escritor.writerow(["codigo", "funcion", "pelicula", "horario", "sala", "asientos", "cliente", "correo",
+                           "coleccionable", "precio_extra", "precio_boleto", "total"])
+        for desde in range(0, len(self.codigos), bloque):
+            filas = []
+            for fila in range(desde, min(desde + bloque, len(self.codigos))):
+                if self.activo[fila]:
+                    funcion, cliente, indices = self.funciones.obtener(self.funcion[fila]), self.clientes[self.cliente[fila]], self.indices(fila)
+                    filas.append([f"{self.codigos[fila]:08X}", funcion.id, funcion.pelicula.titulo, funcion.horario.isoformat(),
+                                  self.sala[fila], " ".join(map(funcion.sala.etiqueta, indices)), cliente.nombre, cliente.correo,
+                                  self.coleccionable[fila], self.precio_extra[fila], self.precio_boleto[fila],
+                                  len(indices) * self.precio_boleto[fila] + self.precio_extra[fila]])
+            escritor.writerows(filas)
+
+    def exportar_binario(self, archivo, bloque=65536):
+        # Las columnas tal cual, por bloques: cabecera y luego, por bloque, cantidad de filas y cada columna;
+        # un bloque vacío cierra los datos y al final van la tabla de clientes y la de contadores del inventario
+        archivo.write(_VENTAS_MAGIA)
+        with self._candado:
+            # Con el candado ninguna fila está a medio agregar; las columnas solo crecen, así que las primeras `total` no cambian
+            total = len(self.codigos)
+        for desde in range(0, total, bloque):
+            hasta = min(desde + bloque, total)
+            inicio, fin = self.inicio_asientos[desde], self.inicio_asientos[hasta]
+            cantidades = array("H", map(operator.sub, self.inicio_asientos[desde + 1:hasta + 1], self.inicio_asientos[desde:hasta]))
+            archivo.write(struct.pack("<I", hasta - desde))
+            for columna in (self.codigos, self.funcion, self.sala, self.cliente, self.precio_extra, self.precio_boleto):
+                archivo.write(columna[desde:hasta].tobytes())
+            archivo.write(bytes(self.coleccionable[desde:hasta]) + bytes(self.activo[desde:hasta]) + self.existencia[desde:hasta].tobytes())
+            archivo.write(cantidades.tobytes() + self.asientos[inicio:fin].tobytes())
+        archivo.write(struct.pack("<I", 0) + struct.pack("<I", len(self.clientes)))
+        archivo.write(b"".join(_codificar_texto(c.nombre) + _codificar_texto(c.correo) for c in list(self.clientes)))
+        archivo.write(_codificar_texto(json.dumps(self.existencias[1:])))
+
+    def cargar_binario(self, archivo, clientes=None):
+        # Carga una exportación de exportar_binario en un libro vacío: cada columna entra de una vez con frombytes y los
+        # índices se arman de las columnas, sin pasar por una venta por fila. clientes: correo -> Cliente ya conocidos
+        if self.codigos:
+            raise ValueError("El libro de ventas no está vacío.")
+        clientes = {} if clientes is None else clientes
+        for bloque in leer_ventas_binarias(archivo):
+            if "clientes" in bloque:
+                break
+            for nombre in ("codigos", "funcion", "sala", "cliente", "precio_extra", "precio_boleto", "coleccionable", "activo", "existencia", "asientos"):
+                getattr(self, nombre).extend(bloque[nombre])
+            self.inicio_asientos.extend(itertools.islice(itertools.accumulate(bloque["asientos_por_fila"], initial=self.inicio_asientos[-1]), 1, None))
+        self.existencias = [None] + bloque["existencias"]
+        ids = [self._id(clientes.get(correo) or clientes.setdefault(correo, Cliente(nombre, correo))) for nombre, correo in bloque["clientes"]]
+        if ids != list(range(len(ids))):
+            # Dos entradas con el mismo correo quedan en un solo cliente
+            self.cliente = array("I", [ids[i] for i in self.cliente])
+        filas = range(len(self.codigos))
+        for fila, id_funcion, id_cliente in zip(filas, self.funcion, self.cliente):
+            self.por_funcion[id_funcion].append(fila)
+            self.por_cliente[id_cliente].append(fila)
+        self.por_codigo = dict(zip(itertools.compress(self.codigos, self.activo), itertools.compress(filas, self.activo)))
+        inactivas = list(map(operator.not_, self.activo))
+        self.cancelados = dict(zip(itertools.compress(self.codigos, inactivas), itertools.compress(filas, inactivas)))
+        return filas
+
+def leer_ventas_binarias(archivo):
+    # Lee una exportación de RepositorioBoletos.exportar_binario; devuelve un diccionario de columnas por bloque
+    # y, al final, {"clientes": [(nombre, correo)], "existencias": [(titulo, complejo)]}
+    if archivo.read(len(_VENTAS_MAGIA)) != _VENTAS_MAGIA:
+        raise ValueError("Exportación de ventas inválida.")
+    while n := struct.unpack("<I", archivo.read(4))[0]:
+        bloque = {}
+        for nombre, tipo in (("codigos", "I"), ("funcion", "I"), ("sala", "I"), ("cliente", "I"), ("precio_extra", "d"), ("precio_boleto", "d")):
+            bloque[nombre] = array(tipo)
+            bloque[nombre].frombytes(archivo.read(n * bloque[nombre].itemsize))
+        bloque["coleccionable"], bloque["activo"], bloque["existencia"] = bytearray(archivo.read(n)), bytearray(archivo.read(n)), array("H")
+        bloque["existencia"].frombytes(archivo.read(2 * n))
+        cantidades = array("H")
+        cantidades.frombytes(archivo.read(2 * n))
+        bloque["asientos_por_fila"], bloque["asientos"] = cantidades, array("H")
+        bloque["asientos"].frombytes(archivo.read(2 * sum(cantidades)))
+        yield bloque
+    clientes, datos = [], archivo.read()
+    pos = 4
+    for _ in range(struct.unpack_from("<I", datos)[0]):
+        nombre, pos = _leer_texto(datos, pos)
+        correo, pos = _leer_texto(datos, pos)
+        clientes.append((nombre, correo))
+    yield {"clientes": clientes, "existencias": [tuple(clave) for clave in json.loads(_leer_texto(datos, pos)[0])]}
+
+class CarteleraEnCache:
+    # Cartelera armada una vez y mantenida por funciones: cada cambio de asientos marca solo su línea,
+    # y una película o función nueva obliga a rearmar todo
+    def __init__(self, cine):
+        self.cine = cine
+        self.version = 0  # sube con cada cambio que afecta la cartelera
+        self._sucias = set()  # (sala, horario) cambiadas desde la última lectura
+        self._completa = False
+        self._candado = threading.RLock()  # cine.funcion puede registrar funciones, e invalidar, mientras se arma
+        self._posiciones = {}  # (sala, horario) -> (índice de película, índice de función)
+        self._bloques = []  # por película: [encabezado, [línea por función], [(versión, datos) por función], texto, datos]
+        self.texto, self.datos = "No hay películas en cartelera.", []
+
+    def invalidar(self):
+        with self._candado:
+            self._completa = False
+            self._sucias.clear()
+            self.version += 1
+
+    def cambio(self, sala, horario):
+        with self._candado:
+            if self._completa:
+                self._sucias.add((sala, horario))
+            self.version += 1
+
+    def leer(self):
+        with self._candado:
+            if not self._completa:
+                self._armar()
+            elif self._sucias:
+                self._actualizar()
+            return self.texto, self.datos
+
+    def _funcion(self, pelicula, j, horario, sala):
+        f = self.cine.funcion(pelicula, horario)
+        version = sala.versiones.get(horario, 0)
+        status = " (Sala llena)" if sala.is_full(horario) else f" (Ocupación: {sala.get_occupancy(horario):.2f}%)"
+        linea = f"   {j + 1}. {horario.strftime('%I:%M %p')} en Sala {sala.numero}{status}"
+        datos = f and {"id": f.id, "horario": horario.isoformat(), "sala": sala.numero, "ocupacion": round(sala.get_occupancy(horario), 2),
+                       "llena": sala.is_full(horario), "version": version}
+        return linea, (version, datos)
+
+    def _cerrar_bloque(self, bloque, pelicula):
+        encabezado, lineas, funciones = bloque[:3]
+        bloque[3] = "\n".join([encabezado, *lineas])
+        bloque[4] = {"titulo": pelicula.titulo, "informacion": pelicula.mostrar_informacion(),
+                     "funciones": [datos for _, datos in funciones if datos]}
+
+    def _armar(self):
+        self._completa, self._sucias = True, set()
+        self._posiciones, self._bloques = {}, []
+        for i, pel in enumerate(self.cine.cartelera):
+            bloque = [f"{i + 1}. {pel.mostrar_informacion()}", [], [], None, None]
+            for j, (h, s) in enumerate(pel.horarios):
+                self._posiciones[(s, h)] = (i, j)
+                linea, funcion = self._funcion(pel, j, h, s)
+                bloque[1].append(linea)
+                bloque[2].append(funcion)
+            self._cerrar_bloque(bloque, pel)
+            self._bloques.append(bloque)
+        self._unir()
+
+    def _actualizar(self):
+        sucias, self._sucias, tocadas = self._sucias, set(), set()
+        for sala, horario in sucias:
+            if (posicion := self._posiciones.get((sala, horario))) is None:
+                return self._armar()  # Función nueva en una sala conocida
+            i, j = posicion
+            bloque, pelicula = self._bloques[i], self.cine.cartelera[i]
+            if bloque[2][j][0] != sala.versiones.get(horario, 0):
+                bloque[1][j], bloque[2][j] = self._funcion(pelicula, j, horario, sala)
+                tocadas.add(i)
+        for i in tocadas:
+            self._cerrar_bloque(self._bloques[i], self.cine.cartelera[i])
+        if tocadas:
+            self._unir()
+
+    def _unir(self):
+        # Listas nuevas en cada cambio: quien conserve una lectura anterior no la ve cambiar
+        self.texto = "\n".join(b[3] for b in self._bloques) or "No hay películas en cartelera."
+        self.datos = [b[4] for b in self._bloques]
+
+_SOLO_OCUPADOS = bytes(int(estado == OCUPADO) for estado in range(256))  # tabla para bytes.translate
+
+class Analitica:
+    # Ingresos, coleccionables, mapas de calor y curvas de llenado. Nada recorre boleto por boleto: los totales salen
+    # de los acumulados por función del reporte incremental, y los mapas de asientos se suman de a muchos bytes a la vez.
+    def __init__(self, cine):
+        self.cine = cine
+
+    def por_funcion(self, inicio=None, fin=None):
+        return self.cine.reporte.por_funcion(inicio or datetime.min, fin or datetime.max)
+
+    def ingresos(self, por="funcion", inicio=None, fin=None):
+        if por in ("dia", "hora"):
+            return self.cine.reporte_ingresos(inicio, fin, por)  # Sale de los totales por cubeta, sin bajar a funciones
+        clave = {"funcion": lambda f: f.id, "sala": lambda f: f.sala.numero,
+                 "pelicula": lambda f: f.pelicula.titulo, "complejo": lambda f: f.sala.complejo}[por]
+        resultado = defaultdict(float)
+        for funcion, (_, _, ingresos, _, _) in self.por_funcion(inicio, fin).items():
+            resultado[clave(funcion)] += ingresos
+        return dict(resultado)
+
+    def coleccionables(self, inicio=None, fin=None):
+        # Por película con coleccionable: boletos, cuántos lo llevaron, tasa de adhesión e ingresos extra
+        totales = defaultdict(lambda: [0, 0, 0.0])
+        for funcion, (boletos, _, _, con_coleccionable, extras) in self.por_funcion(inicio, fin).items():
+            if funcion.pelicula.coleccionable:
+                t = totales[funcion.pelicula.titulo]
+                t[0] += boletos
+                t[1] += con_coleccionable
+                t[2] += extras
+        return {titulo: {"boletos": b, "con_coleccionable": c, "tasa": c / b, "ingresos": e} for titulo, (b, c, e) in totales.items()}
+
+    def mapa_calor(self, sala, inicio=None, fin=None):
+        # Veces que se vendió cada asiento en las funciones de la sala con mapa ya creado (las precargadas sin tocar no
+        # tienen asientos concretos). Cada mapa se suma como un entero grande con un byte por asiento: hasta 255 mapas
+        # no hay acarreo entre asientos, y recién ahí se vuelca el parcial a contadores de 32 bits.
+        n = sala.filas * sala.columnas
+        conteo, parcial, en_parcial, funciones = array("I", bytes(4 * n)), 0, 0, 0
+        for funcion in self.cine.funciones.de_sala(sala, inicio, fin):
+            if (mapa := sala.horarios_asientos.get(funcion.horario)) is None:
+                continue
+            parcial += int.from_bytes(mapa.translate(_SOLO_OCUPADOS), "little")
+            funciones += 1
+            if (en_parcial := en_parcial + 1) == 255:
+                conteo = array("I", map(operator.add, conteo, parcial.to_bytes(n, "little")))
+                parcial = en_parcial = 0
+        if en_parcial:
+            conteo = array("I", map(operator.add, conteo, parcial.to_bytes(n, "little")))
+        return {"funciones": funciones, "filas": [conteo[f * sala.columnas:(f + 1) * sala.columnas].tolist() for f in range(sala.filas)]}
+
+    def curva_llenado(self, inicio=None, fin=None):
+        # Ocupación promedio (%) de las funciones según la hora en que empiezan
+        suma, cantidad = [0.0] * 24, [0] * 24
+        funciones = self.cine.funciones.en_ventana(inicio, fin) if inicio or fin else self.cine.funciones
+        for funcion in funciones:
+            sala, hora = funcion.sala, funcion.horario.hour
+            suma[hora] += sala.ocupados.get(funcion.horario, 0) / (sala.filas * sala.columnas)
+            cantidad[hora] += 1
+        return {hora: 100 * suma[hora] / cantidad[hora] for hora in range(24) if cantidad[hora]}
+
+class Espera:
+    __slots__ = ("id", "funcion", "cliente", "cantidad", "prioridad", "segundos", "comprar", "aviso", "activa", "reserva", "boleto", "error")
+
+    def __init__(self, id_espera, funcion, cliente, cantidad, prioridad, segundos, comprar, aviso):
+        self.id, self.funcion, self.cliente, self.cantidad = id_espera, funcion, cliente, cantidad
+        self.prioridad, self.segundos, self.comprar, self.aviso = prioridad, segundos, comprar, aviso
+        self.activa, self.reserva, self.boleto, self.error = True, None, None, None
+
+class _ColaEspera:
+    __slots__ = ("por_cantidad", "activas", "despachando", "otra_vez")
+
+    def __init__(self):
+        self.por_cantidad = {}  # cantidad de asientos -> heap de (-prioridad, turno, Espera)
+        self.activas = 0
+        self.despachando = self.otra_vez = False
+
+class ListaEspera:
+    # Listas de espera por función, movidas por los avisos de la sala: cada vez que cambian los asientos de una
+    # función con espera, los libres van al primer pedido que entra (mayor prioridad y después orden de llegada).
+    # El asignado recibe una retención por `segundos`; si vence sin confirmarse, la liberación avisa al siguiente.
+    def __init__(self, cine):
+        self.cine = cine
+        self.colas = {}  # (sala, horario) -> _ColaEspera
+        self.esperas = {}  # id -> Espera activa
+        self._turnos = itertools.count()
+        self._candado = threading.Lock()
+
+    def agregar(self, funcion, cliente, cantidad, prioridad=0, segundos=300, comprar=False, aviso=None):
+        if not 1 <= cantidad <= funcion.sala.filas * funcion.sala.columnas:
+            raise ValueError("Cantidad de asientos inválida.")
+        with self._candado:
+            espera = Espera(next(self._turnos), funcion, cliente, cantidad, prioridad, segundos, comprar, aviso)
+            cola = self.colas.get((funcion.sala, funcion.horario)) or self.colas.setdefault((funcion.sala, funcion.horario), _ColaEspera())
+            heapq.heappush(cola.por_cantidad.setdefault(cantidad, []), (-prioridad, espera.id, espera))
+            cola.activas += 1
+            self.esperas[espera.id] = espera
+        self.cambio(funcion.sala, funcion.horario)  # Puede haber lugar ya mismo
+        return espera
+
+    def cancelar(self, id_espera):
+        with self._candado:
+            if espera := self.esperas.pop(id_espera, None):
+                espera.activa = False  # Se descarta del heap cuando llega arriba
+                clave = (espera.funcion.sala, espera.funcion.horario)
+                if cola := self.colas.get(clave):
+                    cola.activas -= 1
+                    if not cola.activas and not cola.despachando:
+                        del self.colas[clave]
+        return espera is not None
+
+    def pendientes(self, funcion):
+        return cola.activas if (cola := self.colas.get((funcion.sala, funcion.horario))) else 0
+
+    def cambio(self, sala, horario):
+        if not (cola := self.colas.get((sala, horario))):
+            return
+        with self._candado:
+            # Las retenciones que hace el despacho vuelven a avisar en el mismo hilo: no se despacha dos veces a la vez
+            if cola.despachando:
+                cola.otra_vez = True
+                return
+            cola.despachando = True
+        try:
+            while True:
+                self._despachar(sala, horario, cola)
+                with self._candado:
+                    # Se deja de despachar en el mismo paso en que se mira otra_vez, para no perder un aviso
+                    if not cola.otra_vez:
+                        cola.despachando = False
+                        if not cola.activas:
+                            self.colas.pop((sala, horario), None)
+                        return
+                    cola.otra_vez = False
+        except BaseException:
+            with self._candado:
+                cola.despachando = False
+            raise
+
+    def _siguiente(self, cola, libres):
+        # El mejor pedido que entra en los asientos libres: mira el tope del heap de cada tamaño, O(tamaños + log n)
+        mejor = None
+        for cantidad in list(cola.por_cantidad):
+            heap = cola.por_cantidad[cantidad]
+            while heap and not heap[0][2].activa:
+                heapq.heappop(heap)
+            if not heap:
+                del cola.por_cantidad[cantidad]
+            elif cantidad <= libres and (mejor is None or heap[0] < mejor):
+                mejor = heap[0]
+        if mejor:
+            heapq.heappop(cola.por_cantidad[mejor[2].cantidad])
+        return mejor
+
+    def _despachar(self, sala, horario, cola):
+        while (libres := sala.filas * sala.columnas - sala.ocupados.get(horario, 0)) > 0:
+            with self._candado:
+                if not (entrada := self._siguiente(cola, libres)):
+                    return
+            espera = entrada[2]
+            funcion = espera.funcion
+            try:
+                espera.reserva = self.cine.retener_mejores(espera.cliente, funcion.pelicula, horario, espera.cantidad, espera.segundos)
+            except ValueError:
+                # Otra venta ganó los asientos: el pedido vuelve a su lugar y espera el próximo aviso
+                with self._candado:
+                    heapq.heappush(cola.por_cantidad.setdefault(espera.cantidad, []), entrada)
+                return
+            with self._candado:
+                espera.activa, cancelada = False, self.esperas.pop(espera.id, None) is None
+                cola.activas -= not cancelada  # si se canceló, ya lo descontó cancelar
+            if cancelada:
+                # Se canceló mientras se le buscaban asientos
+                self.cine.liberar_reserva(espera.reserva.id)
+                espera.reserva = None
+                continue
+            try:
+                if espera.comprar:
+                    espera.boleto = self.cine.confirmar_reserva(espera.reserva.id)
+                if espera.aviso:
+                    espera.aviso(espera)
+            except Exception as e:
+                # Esto corre dentro de la operación que liberó los asientos (una cancelación, un vencimiento):
+                # el error queda en la espera y no la interrumpe
+                espera.error = e
+                if espera.comprar and not espera.boleto:
+                    self.cine.liberar_reserva(espera.reserva.id)
+
+class FiltroBloom:
+    # Filtro de Bloom sobre códigos de boleto (enteros de 32 bits ya aleatorios): un multiplicador los mezcla y
+    # las k posiciones salen por doble hash. Con ~10 bits por código los falsos positivos quedan cerca del 1 %.
+    def __init__(self, cantidad, bits_por_elemento=10, funciones=4):
+        self.capacidad = max(1, cantidad)  # códigos para los que se dimensionó; más allá crecen los falsos positivos
+        self.tamano = 1 << max(6, (max(1, cantidad) * bits_por_elemento - 1).bit_length())
+        self.funciones = funciones
+        self.bits = bytearray(self.tamano // 8)
+
+    def _posiciones(self, clave):
+        mezcla = (clave * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        base, paso, mascara = mezcla & 0xFFFFFFFF, (mezcla >> 32) | 1, self.tamano - 1
+        return [(base + i * paso) & mascara for i in range(self.funciones)]
+
+    def agregar(self, clave):
+        for p in self._posiciones(clave):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, clave):
+        bits = self.bits
+        return all(bits[p >> 3] >> (p & 7) & 1 for p in self._posiciones(clave))
+
+VALIDO, INVALIDO, DUPLICADO, CANCELADO = "valido", "invalido", "duplicado", "cancelado"  # resultados de un escaneo
+
+class ControlAcceso:
+    # Control de entrada de una función, armado una vez antes de abrir las puertas: los códigos vendidos en un arreglo
+    # ordenado (4 bytes por boleto), un filtro de Bloom que rechaza la mayoría de los códigos ajenos sin buscarlos,
+    # y un byte por boleto con la puerta por la que entró (0 = todavía no entró). Los cancelados también entran, para
+    # responder CANCELADO y no INVALIDO.
+    def __init__(self, libro, funcion, franjas=16):
+        self.libro, self.funcion = libro, funcion
+        filas = sorted((libro.codigos[f], f) for f in libro.por_funcion.get(funcion.id, ()))
+        self.codigos, self.filas = array("I", (c for c, _ in filas)), array("I", (f for _, f in filas))
+        self.entradas = bytearray(len(filas))
+        # Una función no tiene más boletos activos que asientos: con esa medida el filtro no se satura aunque el
+        # control se arme antes de las ventas
+        self.filtro = FiltroBloom(max(len(filas), funcion.sala.filas * funcion.sala.columnas))
+        for clave in self.codigos:
+            self.filtro.agregar(clave)
+        self.tardios = {}  # código -> posición en entradas, para lo vendido después de armar el control
+        self._vistas = len(libro.por_funcion.get(funcion.id, ()))  # filas del libro ya incorporadas
+        self._franjas = [threading.Lock() for _ in range(franjas)]  # las puertas solo compiten si escanean boletos de la misma franja
+        self._candado = threading.Lock()
+
+    def _incorporar_tardios(self):
+        with self._candado:
+            filas = self.libro.por_funcion.get(self.funcion.id, ())
+            nuevas = filas[self._vistas:len(filas)]
+            if len(self.entradas) + len(nuevas) > self.filtro.capacidad:
+                # Las cancelaciones y reventas sumaron más filas que asientos: se rearma el filtro al doble
+                filtro = FiltroBloom(2 * (len(self.entradas) + len(nuevas)))
+                for clave in itertools.chain(self.codigos, self.tardios):
+                    filtro.agregar(clave)
+                self.filtro = filtro
+            for fila in nuevas:
+                clave = self.libro.codigos[fila]
+                self.filtro.agregar(clave)
+                self.tardios[clave] = (len(self.entradas), fila)
+                self.entradas.append(0)
+            self._vistas = len(filas)
+
+    def _buscar(self, clave):
+        i = bisect.bisect_left(self.codigos, clave)
+        if i < len(self.codigos) and self.codigos[i] == clave:
+            return i, self.filas[i]
+        return self.tardios.get(clave)
+
+    def validar(self, codigo, puerta=1):
+        # La puerta se guarda en un byte y 0 es "todavía no entró"
+        if isinstance(puerta, bool) or not isinstance(puerta, int) or not 1 <= puerta <= 255:
+            raise ValueError("La puerta debe ser un número entre 1 y 255.")
+        if (clave := RepositorioBoletos._clave(codigo)) is None:
+            return INVALIDO
+        if len(self.libro.por_funcion.get(self.funcion.id, ())) != self._vistas:
+            self._incorporar_tardios()
+        if clave not in self.filtro or not (encontrado := self._buscar(clave)):
+            return INVALIDO
+        posicion, fila = encontrado
+        if not self.libro.activo[fila]:
+            return CANCELADO
+        with self._franjas[posicion % len(self._franjas)]:
+            if self.entradas[posicion]:
+                return DUPLICADO
+            self.entradas[posicion] = puerta
+        return VALIDO
+
+    def puerta(self, codigo):
+        # Por qué puerta entró el boleto, o None
+        clave = RepositorioBoletos._clave(codigo)
+        encontrado = clave is not None and self._buscar(clave)
+        return (self.entradas[encontrado[0]] or None) if encontrado else None
+
+    def resumen(self):
+        activo = self.libro.activo
+        boletos = sum(activo[fila] for fila in self.filas) + sum(activo[fila] for _, fila in self.tardios.values())
+        return {"boletos": boletos, "ingresaron": len(self.entradas) - self.entradas.count(0)}
+
+class ContadorRepartido:
+    # Existencias repartidas en franjas con su propio candado: cada hilo descuenta de su franja y solo toca las otras
+    # cuando a la suya no le alcanza, así las ventas simultáneas casi nunca esperan por el mismo candado
+    _hilo = threading.local()
+    _turnos = itertools.count()
+
+    def __init__(self, cantidad=0, franjas=8):
+        self._franjas = [[0, threading.Lock()] for _ in range(franjas)]
+        self.agregar(cantidad)
+
+    def _propia(self):
+        if (franja := getattr(self._hilo, "franja", None)) is None:
+            franja = self._hilo.franja = next(self._turnos)
+        return franja % len(self._franjas)
+
+    @property
+    def total(self):
+        return sum(franja[0] for franja in self._franjas)
+
+    def agregar(self, cantidad):
+        # Reparte las unidades nuevas entre todas las franjas
+        parte, resto = divmod(cantidad, len(self._franjas))
+        for i, franja in enumerate(self._franjas):
+            with franja[1]:
+                franja[0] += parte + (i < resto)
+
+    def devolver(self, cantidad=1):
+        franja = self._franjas[self._propia()]
+        with franja[1]:
+            franja[0] += cantidad
+
+    def tomar(self, cantidad=1):
+        # Todo o nada: si entre todas las franjas no alcanza no se descuenta nada
+        propia, n, tomadas, faltan = self._propia(), len(self._franjas), [], cantidad
+        for i in range(propia, propia + n):
+            franja = self._franjas[i % n]
+            with franja[1]:
+                parte = min(franja[0], faltan)
+                franja[0] -= parte
+            if parte:
+                tomadas.append((franja, parte))
+                faltan -= parte
+                if not faltan:
+                    return True
+        for franja, parte in tomadas:
+            with franja[1]:
+                franja[0] += parte
+        # Camino lento: otro hilo pudo tener unidades en tránsito entre franjas; con todas bloqueadas el total es exacto
+        for franja in self._franjas:
+            franja[1].acquire()
+        try:
+            if sum(franja[0] for franja in self._franjas) < cantidad:
+                return False
+            for franja in self._franjas:
+                parte = min(franja[0], cantidad)
+                franja[0] -= parte
+                cantidad -= parte
+            return True
+        finally:
+            for franja in self._franjas:
+                franja[1].release()
+
+    def forzar(self, cantidad=1):
+        # Descuenta aunque no alcance (reproducción de la bitácora: la venta ya ocurrió)
+        if not self.tomar(cantidad):
+            self.devolver(-cantidad)
+
+class InventarioColeccionables:
+    # Existencias por película (complejo None) o por película y complejo; una venta descuenta del contador del
+    # complejo si existe y si no del de la película. Sin contador, el coleccionable no tiene límite.
+    def __init__(self, franjas=8):
+        self.franjas = franjas
+        self.contadores = {}  # (titulo, complejo) -> ContadorRepartido
+        self.abastecido = {}  # (titulo, complejo) -> unidades cargadas en total; es lo que se persiste
+        self.umbrales = {}  # (titulo, complejo) -> existencias a partir de las que se avisa
+        self._avisados = set()
+        self._observadores = []
+        self._candado = threading.Lock()
+
+    def suscribir(self, observador):
+        # observador(clave, disponibles) al bajar hasta el umbral; se vuelve a avisar solo si antes se repuso
+        self._observadores.append(observador)
+
+    def abastecer(self, titulo, cantidad, complejo=None, umbral=None):
+        clave = (titulo, complejo)
+        with self._candado:
+            contador = self.contadores.get(clave)
+            if contador is None:
+                contador = self.contadores[clave] = ContadorRepartido(0, self.franjas)
+                self.abastecido[clave] = 0
+            if umbral is not None:
+                self.umbrales[clave] = umbral
+        if cantidad >= 0:
+            contador.agregar(cantidad)
+        elif not contador.tomar(-cantidad):
+            raise ValueError("No hay tantas unidades en existencia.")
+        with self._candado:
+            self.abastecido[clave] += cantidad
+        self._revisar(clave)
+        return contador.total
+
+    def clave(self, titulo, complejo=None):
+        if (titulo, complejo) in self.contadores:
+            return titulo, complejo
+        return (titulo, None) if (titulo, None) in self.contadores else None
+
+    def disponibles(self, titulo, complejo=None):
+        clave = self.clave(titulo, complejo)
+        return self.contadores[clave].total if clave else None
+
+    def reservar(self, titulo, complejo=None, cantidad=1):
+        # Devuelve la clave del contador usado (None si no hay límite), para devolver la unidad si la venta no sigue
+        if not (clave := self.clave(titulo, complejo)):
+            return None
+        if not self.contadores[clave].tomar(cantidad):
+            raise ValueError("Coleccionable agotado.")
+        self._revisar(clave)
+        return clave
+
+    def liberar(self, clave, cantidad=1):
+        if clave:
+            self.contadores[clave].devolver(cantidad)
+            self._revisar(clave)
+
+    def consumir(self, titulo, complejo=None, cantidad=1):
+        if clave := self.clave(titulo, complejo):
+            self.contadores[clave].forzar(cantidad)
+        return clave
+
+    def descontar(self, clave, cantidad=1):
+        # Como consumir, sobre un contador ya conocido
+        if clave in self.contadores:
+            self.contadores[clave].forzar(cantidad)
+
+    def bajo_stock(self):
+        return {clave: self.contadores[clave].total for clave, umbral in self.umbrales.items() if self.contadores[clave].total <= umbral}
+
+    def _revisar(self, clave):
+        if (umbral := self.umbrales.get(clave)) is None:
+            return
+        disponibles = self.contadores[clave].total
+        with self._candado:
+            if disponibles > umbral:
+                self._avisados.discard(clave)
+                return
+            if clave in self._avisados:
+                return
+            self._avisados.add(clave)
+        for observador in self._observadores:
+            observador(clave, disponibles)
+
 class Cine:
     def __init__(self, nombre):
-        self.nombre, self.salas, self.cartelera, self.ventas = nombre, [], [], []
+        self.nombre, self.salas, self.cartelera = nombre, [], []
+        self.funciones = RegistroFunciones()
+        self.ventas = RepositorioBoletos(self.funciones)
+        self.reporte = ReporteIncremental()
+        self.reservas = {}  # id -> Reserva activa
+        self.rueda = RuedaTemporizadora()
+        self._reloj = None  # hilo que avanza la rueda mientras haya reservas; se detiene solo al quedar ninguna
+        self._candado_reloj = threading.Lock()
+        self._ids_reserva = itertools.count(1)
+        self._en_cartelera = set()
+        self._horarios_vistos = {}  # Pelicula -> cuántos de sus horarios ya revisó funcion()
+        self.clientes = {}  # correo -> Cliente
+        self.bitacora = None
+        self._compuerta = Compuerta()  # guardar_instantanea contra las operaciones que anotan y cambian el estado por separado
+        self.vista_cartelera = CarteleraEnCache(self)
+        self.analitica = Analitica(self)
+        self.lista_espera = ListaEspera(self)
+        self.controles = {}  # Funcion -> ControlAcceso, armado al primer escaneo
+        self.inventario = InventarioColeccionables()
+
+    def _anotar(self, tipo, contenido):
+        if self.bitacora:
+            self.bitacora.escribir(tipo, contenido if isinstance(contenido, bytes) else json.dumps(contenido).encode())
+
+    def _observar(self, sala):
+        sala.suscribir(self.vista_cartelera.cambio)
+        sala.suscribir(self.lista_espera.cambio)
 
     def agregar_sala(self, sala):
         self.salas.append(sala)
+        self._observar(sala)
+        self._anotar(SALA, {"numero": sala.numero, "filas": sala.filas, "columnas": sala.columnas, "complejo": sala.complejo, "limpieza": sala.limpieza})
 
     def agregar_pelicula(self, pelicula):
-        self.cartelera.append(pelicula)
+        if pelicula not in self._en_cartelera:
+            self._en_cartelera.add(pelicula)
+            self.cartelera.append(pelicula)
+            self.vista_cartelera.invalidar()
+            self._anotar(PELICULA, self._datos_pelicula(pelicula))
+        for h, s in pelicula.horarios:
+            self._registrar_funcion(pelicula, h, s)
+
+    def _registrar_funcion(self, pelicula, horario, sala):
+        if funcion := self.funciones.buscar(pelicula, horario):
+            return funcion
+        funcion = self.funciones.registrar(pelicula, horario, sala)
+        self._observar(sala)
+        self.vista_cartelera.invalidar()
+        if self.bitacora:
+            self._anotar(FUNCION, self._datos_funcion(funcion))
+        return funcion
+
+    def agregar_funcion(self, pelicula, horario, sala):
+        if existente := self.funciones.buscar(pelicula, horario):
+            if existente.sala is not sala:
+                raise ValueError("La película ya tiene una función a ese horario en otra sala.")
+            return existente
+        pelicula.agregar_horario(horario, sala)
+        if pelicula not in self._en_cartelera:
+            self.agregar_pelicula(pelicula)
+        return self._registrar_funcion(pelicula, horario, sala)
+
+    def funcion(self, pelicula, horario):
+        if (funcion := self.funciones.buscar(pelicula, horario)) or pelicula not in self._en_cartelera:
+            return funcion
+        # Horarios agregados directamente con Pelicula.agregar_horario después de entrar en cartelera. Solo se revisa
+        # la cola nueva: pelicula.horarios solo crece, y un horario ya revisado quedó registrado
+        if (vistos := self._horarios_vistos.get(pelicula, 0)) == len(pelicula.horarios):
+            return None
+        nuevos = pelicula.horarios[vistos:]
+        self._horarios_vistos[pelicula] = vistos + len(nuevos)
+        for h, s in nuevos:
+            self._registrar_funcion(pelicula, h, s)
+        return self.funciones.buscar(pelicula, horario)
 
     def mostrar_cartelera(self):
-        if not self.cartelera:
-            return print("No hay películas en cartelera.")
-        for idx, pel in enumerate(self.cartelera, 1):
-            print(f"{idx}. {pel.mostrar_informacion()}")
-            for i, (h, s) in enumerate(pel.horarios, 1):
-                status = " (Sala llena)" if s.is_full(h) else f" (Ocupación: {s.get_occupancy(h):.2f}%)"
-                print(f"   {i}. {h.strftime('%I:%M %p')} en Sala {s.numero}{status}")
+        self.procesar_vencimientos()
+        print(self.vista_cartelera.leer()[0])
 
-    def vender_boleto(self, cliente, pelicula, horario, asientos, coleccionable=False):
-        if pelicula not in self.cartelera or not (sala := next((s for h, s in pelicula.horarios if h == horario), None)):
+    def datos_cartelera(self):
+        # Compartidos con la caché: no modificar
+        self.procesar_vencimientos()
+        return self.vista_cartelera.leer()[1]
+
+    def recomendar_funciones(self, pelicula, horario, k=2, horas=3, similares=True):
+        # Las k funciones menos ocupadas de la película (o de películas similares) que empiezan a ±horas,
+        # sin salas llenas y en el mismo complejo que la función de referencia
+        self.procesar_vencimientos()
+        actual = self.funcion(pelicula, horario)
+        complejo = actual.sala.complejo if actual else None
+        desde, hasta = horario - timedelta(hours=horas), horario + timedelta(hours=horas)
+        candidatas = (self.funciones.similares if similares else self.funciones.de_pelicula)(pelicula, desde, hasta)
+        return heapq.nsmallest(k, (f for f in candidatas if f is not actual and not f.sala.is_full(f.horario)
+                                   and (complejo is None or f.sala.complejo == complejo)),
+                               key=lambda f: f.sala.get_occupancy(f.horario))
+
+    def esperar_funcion(self, cliente, pelicula, horario, cantidad, prioridad=0, segundos=300, comprar=False, aviso=None):
+        # Lista de espera para una función llena: al liberarse lugar se retienen los asientos (o se compran, con
+        # comprar=True) y se llama a aviso(espera)
+        if not (funcion := self.funcion(pelicula, horario)):
+            raise ValueError("Película o horario no disponible.")
+        return self.lista_espera.agregar(funcion, cliente, cantidad, prioridad, segundos, comprar, aviso)
+
+    def cancelar_espera(self, id_espera):
+        return self.lista_espera.cancelar(id_espera)
+
+    def control_acceso(self, pelicula, horario):
+        if not (funcion := self.funcion(pelicula, horario)):
             raise ValueError("Película o horario no disponible.")
-        if sala.is_full(horario):
+        return self.controles.get(funcion) or self.controles.setdefault(funcion, ControlAcceso(self.ventas, funcion))
+
+    def registrar_ingreso(self, codigo, puerta=1, pelicula=None, horario=None):
+        # Con película y horario valida contra esa función; sin ellos, busca la función del boleto en el libro
+        if pelicula is not None:
+            return self.control_acceso(pelicula, horario).validar(codigo, puerta)
+        if (fila := self.ventas.fila(codigo)) is None and (fila := self.ventas.cancelados.get(self.ventas._clave(codigo))) is None:
+            return INVALIDO
+        # Un cancelado también va al control de su función, que responde CANCELADO
+        funcion = self.funciones.obtener(self.ventas.funcion[fila])
+        return self.control_acceso(funcion.pelicula, funcion.horario).validar(codigo, puerta)
+
+    def _funcion_disponible(self, pelicula, horario):
+        self.procesar_vencimientos()
+        if not (funcion := self.funcion(pelicula, horario)):
+            raise ValueError("Película o horario no disponible.")
+        if funcion.sala.is_full(horario):
             raise ValueError("Sala llena.")
-        sala.ocupar_asientos(horario, asientos)
-        precio_extra = pelicula.precio_coleccionable if coleccionable else 0
-        boleto = Boleto(uuid.uuid4().hex[:8].upper(), pelicula, horario, asientos, cliente,
-                        pelicula.coleccionable if coleccionable else None, precio_extra)
-        self.ventas.append(boleto)
-        cliente.boletos.append(boleto)
-        return boleto
+        return funcion
+
+    def abastecer_coleccionable(self, pelicula, cantidad, complejo=None, umbral=None):
+        # Suma (o con cantidad negativa, retira) unidades del coleccionable de la película, en general o para un complejo
+        if not pelicula.coleccionable:
+            raise ValueError("La película no tiene coleccionable.")
+        # El registro es una diferencia: una instantánea entre el contador y la bitácora la sumaría dos veces al recuperar
+        with self._compuerta.compartida():
+            disponibles = self.inventario.abastecer(pelicula.titulo, cantidad, complejo, umbral)
+            self._anotar(INVENTARIO, {"pelicula": pelicula.titulo, "cantidad": cantidad, "complejo": complejo, "umbral": umbral})
+        return disponibles
+
+    def _reservar_coleccionable(self, funcion, coleccionable):
+        if coleccionable and funcion.pelicula.coleccionable:
+            return self.inventario.reservar(funcion.pelicula.titulo, funcion.sala.complejo)
+
+    def vender_boleto(self, cliente, pelicula, horario, asientos, coleccionable=False):
+        if not asientos:
+            raise ValueError("Hay que elegir al menos un asiento.")
+        funcion = self._funcion_disponible(pelicula, horario)
+        # El coleccionable se aparta antes que los asientos: si alguno de los dos falla, el otro se devuelve
+        clave = self._reservar_coleccionable(funcion, coleccionable)
+        try:
+            funcion.sala.ocupar_asientos(horario, asientos)
+        except ValueError:
+            self.inventario.liberar(clave)
+            raise
+        return self._emitir_boleto(funcion, cliente, asientos, coleccionable, clave)
+
+    def retener_asientos(self, cliente, pelicula, horario, asientos, segundos=300):
+        if not asientos:
+            raise ValueError("Hay que elegir al menos un asiento.")
+        funcion = self._funcion_disponible(pelicula, horario)
+        funcion.sala.retener_asientos(horario, asientos)
+        id_reserva, vence = next(self._ids_reserva), time.monotonic() + segundos
+        reserva = self.reservas[id_reserva] = Reserva(id_reserva, funcion, list(asientos), cliente, vence)
+        self.rueda.agregar(id_reserva, vence)
+        self._arrancar_reloj()
+        return reserva
+
+    def _arrancar_reloj(self):
+        # Las operaciones también avanzan la rueda, pero sin tráfico una retención vencida (por ejemplo la de la lista
+        # de espera) no liberaría sus asientos ni despertaría al siguiente hasta la próxima operación
+        with self._candado_reloj:
+            if self._reloj is None:
+                self._reloj = threading.Thread(target=self._marcar_vencimientos, daemon=True, name="vencimientos")
+                self._reloj.start()
+
+    def _marcar_vencimientos(self):
+        while True:
+            time.sleep(self.rueda.resolucion)
+            self.procesar_vencimientos()
+            with self._candado_reloj:
+                # Una reserva nueva entra en self.reservas antes de pedir el reloj: si se ve vacío, quien llegue después
+                # encuentra _reloj en None y arranca otro
+                if not self.reservas:
+                    self._reloj = None
+                    return
+
+    def retener_mejores(self, cliente, pelicula, horario, cantidad, segundos=300, intentos=3):
+        funcion = self._funcion_disponible(pelicula, horario)
+        for intento in range(intentos):
+            try:
+                return self.retener_asientos(cliente, pelicula, horario, funcion.sala.mejores_asientos(horario, cantidad), segundos)
+            except ValueError:
+                # Otra terminal tomó alguno de los asientos propuestos entre la búsqueda y la retención
+                if intento == intentos - 1:
+                    raise
+
+    def confirmar_reserva(self, id_reserva, coleccionable=False):
+        self.procesar_vencimientos()
+        if not (reserva := self.reservas.get(id_reserva)):
+            raise ValueError("La reserva no existe o ya venció.")
+        # Sin coleccionable la reserva sigue en pie y se puede confirmar sin él
+        clave = self._reservar_coleccionable(reserva.funcion, coleccionable)
+        # Confirmar y vencer compiten por retirar la reserva; solo uno lo logra
+        if self.reservas.pop(id_reserva, None) is not reserva:
+            self.inventario.liberar(clave)
+            raise ValueError("La reserva no existe o ya venció.")
+        reserva.funcion.sala.confirmar_asientos(reserva.funcion.horario, reserva.asientos)
+        return self._emitir_boleto(reserva.funcion, reserva.cliente, reserva.asientos, coleccionable, clave)
+
+    def liberar_reserva(self, id_reserva):
+        if reserva := self.reservas.pop(id_reserva, None):
+            reserva.funcion.sala.liberar_asientos(reserva.funcion.horario, reserva.asientos)
+        return reserva is not None
+
+    def procesar_vencimientos(self, ahora=None):
+        for id_reserva in self.rueda.avanzar(time.monotonic() if ahora is None else ahora):
+            self.liberar_reserva(id_reserva)
+
+    def _emitir_boleto(self, funcion, cliente, asientos, coleccionable, existencia=None):
+        fila, = self._emitir_lote(funcion, [(cliente, funcion.pelicula, funcion.horario, asientos, coleccionable)],
+                                  [[funcion.sala.indice(a) for a in asientos]], [existencia])
+        pelicula = funcion.pelicula
+        return Boleto(f"{self.ventas.codigos[fila]:08X}", pelicula, funcion.horario, list(asientos), cliente,
+                      pelicula.coleccionable if coleccionable else None, self.ventas.precio_extra[fila], pelicula.precio_boleto)
+
+    def vender_boletos_lote(self, pedidos):
+        # pedidos: (cliente, pelicula, horario, asientos, coleccionable); devuelve por pedido su boleto (una VistaBoleto,
+        # que se arma al leerla) o el ValueError que lo rechazó
+        self.procesar_vencimientos()
+        pedidos, grupos = list(pedidos), defaultdict(list)
+        resultados = [None] * len(pedidos)
+        for i, (_, pelicula, horario, _, _) in enumerate(pedidos):
+            grupos[(pelicula, horario)].append(i)
+        for (pelicula, horario), numeros in grupos.items():
+            if not (funcion := self.funcion(pelicula, horario)):
+                for i in numeros:
+                    resultados[i] = ValueError("Película o horario no disponible.")
+                continue
+            aceptados = []
+            if pelicula.coleccionable and self.inventario.clave(pelicula.titulo, funcion.sala.complejo):
+                claves = {}
+                for i in numeros:
+                    try:
+                        claves[i] = self._reservar_coleccionable(funcion, pedidos[i][4])
+                    except ValueError as e:
+                        resultados[i] = e
+            else:
+                claves = dict.fromkeys(numeros)  # sin contador no hay nada que apartar
+            numeros, tomados = list(claves), []
+            for i, indices in zip(numeros, funcion.sala.ocupar_lote(horario, [pedidos[i][3] for i in numeros])):
+                if isinstance(indices, ValueError):
+                    self.inventario.liberar(claves[i])
+                    resultados[i] = indices
+                else:
+                    aceptados.append(i)
+                    tomados.append(indices)
+            filas = self._emitir_lote(funcion, [pedidos[i] for i in aceptados], tomados, [claves[i] for i in aceptados])
+            for i, fila in zip(aceptados, filas):
+                resultados[i] = VistaBoleto(self.ventas, fila)
+        return resultados
+
+    def _emitir_lote(self, funcion, pedidos, indices, existencias=None):
+        # Pedidos con los asientos ya tomados; indices: los índices de cada uno, tal como los resolvió la sala.
+        # existencias: por pedido, la clave del contador del que ya se apartó su coleccionable (o None).
+        # Devuelve las filas del libro: ningún Boleto se arma acá
+        if not pedidos:
+            return range(0)
+        pelicula, n = funcion.pelicula, len(pedidos)
+        clientes = [pedido[0] for pedido in pedidos]
+        coleccionables = [bool(pedido[4]) for pedido in pedidos]
+        extras = [pelicula.precio_coleccionable if c else 0 for c in coleccionables]
+        existencias = existencias or [None] * n
+        claves = self.ventas.nuevas_claves(n)
+        filas = self.ventas.agregar_columnas(funcion, claves, indices, clientes, coleccionables, extras, [pelicula.precio_boleto] * n, existencias)
+        if self.bitacora:
+            textos = {}
+            self.bitacora.escribir_varios(VENTA, [_codificar_venta(f"{clave:08X}", funcion.id, extra, pelicula.precio_boleto, 2 if existencia else c,
+                                                                   ix, cliente, textos)
+                                                  for clave, ix, cliente, c, extra, existencia in zip(claves, indices, clientes, coleccionables, extras, existencias)])
+        asientos, total_extras = sum(map(len, indices)), sum(extras)
+        self.reporte.registrar_lote(funcion, n, asientos, asientos * pelicula.precio_boleto + total_extras,
+                                    sum(coleccionables) if pelicula.coleccionable else 0, total_extras)
+        for cliente in clientes:
+            self.clientes.setdefault(cliente.correo, cliente)
+        return filas
 
     def cancelar_boleto(self, codigo):
-        if not (boleto := next((b for b in self.ventas if b.codigo == codigo), None)):
+        if (fila := self.ventas.fila(codigo)) is None:
             raise ValueError("Boleto no encontrado.")
+        boleto, existencia = self.ventas.boleto(fila), self.ventas.existencia_de(fila)
         if datetime.now() >= boleto.horario:
             raise ValueError("No se puede cancelar después del inicio de la función.")
-        if sala := next((s for h, s in boleto.pelicula.horarios if h == boleto.horario), None):
-            sala.liberar_asientos(boleto.horario, boleto.asientos)
-        self.ventas.remove(boleto)
-        boleto.cliente.boletos.remove(boleto)
+        # Entre anotar la cancelación y liberar los asientos no se guarda una instantánea: con el segmento de la
+        # cancelación ya borrado, los asientos quedarían ocupados sin boleto al recuperar
+        with self._compuerta.compartida():
+            # Solo el hilo que logra retirar el boleto libera sus asientos
+            if not self.ventas.eliminar(codigo):
+                raise ValueError("Boleto no encontrado.")
+            if funcion := self.funcion(boleto.pelicula, boleto.horario):
+                indices = [funcion.sala.indice(a) for a in boleto.asientos]
+                # Se anota antes de liberar: una venta que tome estos asientos queda después en la bitácora
+                self._anotar(CANCELACION, _CANCELACION.pack(codigo.encode(), funcion.id, len(indices)) + struct.pack(f"<{len(indices)}H", *indices))
+                self.reporte.registrar(funcion, boleto, -1)
+                # Solo vuelve al inventario lo que se descontó de él
+                self.inventario.liberar(existencia)
+                # Lo último: liberar despierta a la lista de espera, que puede vender en este mismo hilo
+                funcion.sala.liberar_asientos(boleto.horario, boleto.asientos)
         return True
 
     def generar_reporte(self, inicio=None, fin=None):
         inicio, fin = inicio or datetime.min, fin or datetime.max
-        ventas = [v for v in self.ventas if inicio <= v.horario <= fin]
-        if not ventas:
+        return self.formatear_reporte(*self.reporte.consultar(inicio, fin))
+
+    @staticmethod
+    def formatear_reporte(boletos, vistas, concurrencia, total_por_sala):
+        if not boletos:
             return {"mensaje": "No hay ventas en el período seleccionado."}
-        vistas = defaultdict(int)
-        concurrencia = defaultdict(int)
-        total_por_sala = defaultdict(int)
-        for v in ventas:
-            vistas[v.pelicula.titulo] += len(v.asientos)
-            concurrencia[(v.pelicula.titulo, v.horario)] += len(v.asientos)
-            if sala := next((s for h, s in v.pelicula.horarios if h == v.horario), None):
-                total_por_sala[sala.numero] += len(v.asientos)
         return {
             "pelicula_mas_vista": max(vistas, key=vistas.get, default="Ninguna"),
             "horarios_mas_concurridos": [(f"{pel} at {h}", c) for (pel, h), c in sorted(concurrencia.items(), key=lambda x: x[1], reverse=True)],
@@ -137,9 +1834,205 @@ class Cine:
             "total_por_sala": dict(total_por_sala)
         }
 
+    def reporte_ingresos(self, inicio=None, fin=None, por="dia"):
+        paso = {"dia": timedelta(days=1), "hora": timedelta(hours=1)}[por]
+        return self.reporte.ingresos(inicio or datetime.min, fin or datetime.max, paso)
+
+    # --- Persistencia: bitácora de solo anexado e instantáneas ---
+
+    @staticmethod
+    def _datos_pelicula(p):
+        return {"titulo": p.titulo, "genero": p.genero, "duracion": p.duracion, "clasificacion": p.clasificacion,
+                "coleccionable": p.coleccionable, "precio_coleccionable": p.precio_coleccionable, "precio_boleto": p.precio_boleto}
+
+    @staticmethod
+    def _datos_funcion(f):
+        return {"id": f.id, "pelicula": f.pelicula.titulo, "horario": f.horario.isoformat(),
+                "sala": f.sala.numero, "filas": f.sala.filas, "columnas": f.sala.columnas, "complejo": f.sala.complejo,
+                "limpieza": f.sala.limpieza}
+
+    def activar_bitacora(self, directorio, **opciones):
+        segmentos = Bitacora.segmentos(directorio) if os.path.isdir(directorio) else []
+        self.bitacora = Bitacora(directorio, segmentos[-1] if segmentos else 0, **opciones)
+        if not os.path.exists(os.path.join(directorio, "instantanea.bin")):
+            # El estado previo a la bitácora solo queda a salvo en una instantánea
+            self.guardar_instantanea()
+        return self.bitacora
+
+    def guardar_instantanea(self):
+        if not self.bitacora:
+            raise ValueError("La bitácora no está activa.")
+        directorio = self.bitacora.directorio
+        # Con la bitácora bloqueada no entra ningún registro nuevo mientras se copia el estado;
+        # las operaciones a medio camino se vuelven a aplicar desde el segmento nuevo de forma idempotente.
+        # Las que no lo serían (anotan antes de cambiar el estado) se esperan en la compuerta.
+        with self._compuerta.exclusiva(), self.bitacora._candado:
+            segmento = self.bitacora._rotar()
+            funciones = list(self.funciones)
+            salas = {s.numero: s for s in self.salas}
+            for f in funciones:
+                salas.setdefault(f.sala.numero, f.sala)
+            meta = {"nombre": self.nombre, "salas": [[s.numero, s.filas, s.columnas, s.complejo, s in self.salas, s.limpieza] for s in salas.values()],
+                    "cartelera": [self._datos_pelicula(p) for p in self.cartelera],
+                    "funciones": [self._datos_funcion(f) for f in funciones],
+                    "inventario": [{"pelicula": titulo, "complejo": complejo, "cantidad": cantidad, "umbral": self.inventario.umbrales.get((titulo, complejo))}
+                                   for (titulo, complejo), cantidad in self.inventario.abastecido.items()]}
+            bloques = []
+            for f in funciones:
+                mapa = f.sala.horarios_asientos.get(f.horario)
+                if mapa:
+                    # Las retenciones no sobreviven a un reinicio
+                    bloques.append(b"\x01" + bytes(mapa).replace(bytes([RETENIDO]), bytes([LIBRE])))
+                elif (semilla := f.sala._precarga.get(f.horario)) is not None:
+                    bloques.append(b"\x02" + _PRECARGA.pack(semilla, f.sala.ocupados[f.horario]))
+                else:
+                    bloques.append(b"\x00")
+            # El libro va columna por columna, en el formato de exportar_binario, con las filas canceladas incluidas
+            ventas = io.BytesIO()
+            self.ventas.exportar_binario(ventas)
+        contenido = json.dumps(meta).encode()
+        temporal = os.path.join(directorio, "instantanea.tmp")
+        with open(temporal, "wb") as archivo:
+            archivo.write(_INSTANTANEA.pack(_MAGIA, segmento, len(contenido)) + contenido)
+            archivo.writelines(bloques)
+            archivo.write(ventas.getbuffer())
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, os.path.join(directorio, "instantanea.bin"))
+        for viejo in Bitacora.segmentos(directorio):
+            if viejo < segmento:
+                os.remove(Bitacora.ruta_segmento(directorio, viejo))
+        return segmento
+
+    @classmethod
+    def recuperar(cls, directorio, nombre="Cine", **opciones):
+        cine, desde = cls(nombre), 0
+        peliculas, salas = {}, {}
+        ruta = os.path.join(directorio, "instantanea.bin")
+        if os.path.exists(ruta):
+            with open(ruta, "rb") as archivo, mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+                magia, desde, largo = _INSTANTANEA.unpack_from(datos, 0)
+                if magia != _MAGIA:
+                    raise ValueError("Instantánea inválida.")
+                pos = _INSTANTANEA.size
+                meta = json.loads(datos[pos:pos + largo])
+                pos += largo
+                cine.nombre = meta["nombre"]
+                for numero, filas, columnas, complejo, registrada, *limpieza in meta["salas"]:
+                    salas[numero] = Sala(numero, filas, columnas, complejo, *limpieza)
+                    if registrada:
+                        cine.salas.append(salas[numero])
+                for p in meta["cartelera"]:
+                    cine._aplicar(PELICULA, p, peliculas, salas)
+                for datos_inventario in meta.get("inventario", []):
+                    cine._aplicar(INVENTARIO, datos_inventario, peliculas, salas)
+                for f in meta["funciones"]:
+                    funcion = cine._aplicar(FUNCION, f, peliculas, salas)
+                    sala, asignado = funcion.sala, datos[pos]
+                    pos += 1
+                    if asignado == 1:
+                        n = sala.filas * sala.columnas
+                        mapa = sala.horarios_asientos[funcion.horario] = bytearray(datos[pos:pos + n])
+                        sala.ocupados[funcion.horario] = n - mapa.count(LIBRE)
+                        pos += n
+                    elif asignado == 2:
+                        sala.precargar(funcion.horario, *reversed(_PRECARGA.unpack_from(datos, pos)))
+                        pos += _PRECARGA.size
+                datos.seek(pos)
+                cine._cargar_ventas(datos)
+        if os.path.isdir(directorio):
+            for segmento in Bitacora.segmentos(directorio):
+                if segmento >= desde:
+                    for tipo, contenido in Bitacora.leer(Bitacora.ruta_segmento(directorio, segmento)):
+                        cine._aplicar(tipo, contenido, peliculas, salas)
+        cine.activar_bitacora(directorio, **opciones)
+        return cine
+
+    def _cargar_ventas(self, archivo):
+        # Las ventas de la instantánea: los asientos ya vienen en los mapas, así que solo falta sumar el reporte y
+        # descontar del inventario lo que salió de cada contador, por función y por contador en vez de por venta
+        ventas = self.ventas
+        ventas.cargar_binario(archivo, self.clientes)
+        inicio, activo = ventas.inicio_asientos, ventas.activo
+        for id_funcion, filas in ventas.por_funcion.items():
+            funcion, boletos, asientos, ingresos, coleccionables, extras = self.funciones.obtener(id_funcion), 0, 0, 0, 0, 0
+            for fila in filas:
+                if activo[fila]:
+                    n, extra = inicio[fila + 1] - inicio[fila], ventas.precio_extra[fila]
+                    boletos += 1
+                    asientos += n
+                    ingresos += n * ventas.precio_boleto[fila] + extra
+                    coleccionables += ventas.coleccionable[fila]
+                    extras += extra
+            if boletos:
+                self.reporte.registrar_lote(funcion, boletos, asientos, ingresos,
+                                            coleccionables if funcion.pelicula.coleccionable is not None else 0, extras)
+        for id_existencia, cantidad in Counter(itertools.compress(ventas.existencia, activo)).items():
+            if id_existencia:
+                self.inventario.descontar(ventas.existencias[id_existencia], cantidad)
+
+    def _aplicar(self, tipo, contenido, peliculas, salas):
+        if tipo == VENTA:
+            return self._aplicar_venta(_decodificar_venta(contenido)[0])
+        if tipo == CANCELACION:
+            codigo, id_funcion, n = _CANCELACION.unpack_from(contenido)
+            funcion, fila = self.funciones.obtener(id_funcion), self.ventas.fila(codigo.decode())
+            if boleto := self.ventas.eliminar(codigo.decode()):
+                self.reporte.registrar(funcion, boleto, -1)
+                self.inventario.liberar(self.ventas.existencia_de(fila))
+            funcion.sala.restaurar_asientos(funcion.horario, struct.unpack_from(f"<{n}H", contenido, _CANCELACION.size), LIBRE)
+            return boleto
+        datos = json.loads(contenido) if isinstance(contenido, bytes) else contenido
+        if tipo == INVENTARIO:
+            return self.inventario.abastecer(datos["pelicula"], datos["cantidad"], datos["complejo"], datos["umbral"])
+        if tipo == SALA:
+            if datos["numero"] not in salas:
+                salas[datos["numero"]] = Sala(datos["numero"], datos["filas"], datos["columnas"], datos.get("complejo"), datos.get("limpieza", 0))
+                self.salas.append(salas[datos["numero"]])
+            return salas[datos["numero"]]
+        if tipo == PELICULA:
+            if datos["titulo"] not in peliculas:
+                peliculas[datos["titulo"]] = pelicula = Pelicula(**datos)
+                self._en_cartelera.add(pelicula)
+                self.cartelera.append(pelicula)
+                self.vista_cartelera.invalidar()
+            return peliculas[datos["titulo"]]
+        if tipo == FUNCION:
+            pelicula, horario = peliculas[datos["pelicula"]], datetime.fromisoformat(datos["horario"])
+            if funcion := self.funciones.obtener(datos["id"]):
+                return funcion
+            sala = salas.get(datos["sala"]) or salas.setdefault(datos["sala"], Sala(datos["sala"], datos["filas"], datos["columnas"],
+                                                                                     datos.get("complejo"), datos.get("limpieza", 0)))
+            pelicula.agregar_horario(horario, sala)
+            self._observar(sala)
+            self.vista_cartelera.invalidar()
+            return self.funciones.registrar(pelicula, horario, sala, datos["id"])
+        raise ValueError(f"Registro de bitácora desconocido: {tipo}.")
+
+    def _aplicar_venta(self, venta):
+        codigo, id_funcion, precio_extra, precio_boleto, coleccionable, indices, nombre, correo = venta
+        if codigo in self.ventas:
+            return self.ventas.buscar(codigo)
+        funcion = self.funciones.obtener(id_funcion)
+        funcion.sala.restaurar_asientos(funcion.horario, indices)
+        cliente = self.clientes.get(correo) or self.clientes.setdefault(correo, Cliente(nombre, correo))
+        existencia = None
+        if coleccionable == 2:
+            # Las existencias se reconstruyen como lo cargado menos lo vendido; los contadores ya están recreados en el
+            # orden de la bitácora, así que la venta vuelve a caer en el mismo
+            existencia = self.inventario.consumir(funcion.pelicula.titulo, funcion.sala.complejo)
+        boleto = self.ventas.boleto(self.ventas.agregar(funcion, codigo, indices, cliente, coleccionable, precio_extra, precio_boleto, existencia))
+        self.reporte.registrar(funcion, boleto)
+        return boleto
+
 class Cliente:
     def __init__(self, nombre, correo):
-        self.nombre, self.correo, self.boletos = nombre, correo, []
+        self.nombre, self.correo = nombre, correo
+        self.libros = []  # RepositorioBoletos con compras suyas; un mismo cliente puede comprar en más de un cine
+
+    @property
+    def boletos(self):
+        return [b for libro in self.libros for b in libro.de_cliente(self)]
 
     def comprar_boleto(self, cine, pelicula, horario, asientos, coleccionable=False):
         return cine.vender_boleto(self, pelicula, horario, asientos, coleccionable)
@@ -158,19 +2051,289 @@ class Administrador:
         self.nombre, self.id_administrador, self.correo = nombre, id_administrador, correo
 
     def agregar_pelicula(self, cine, pelicula, horario, sala):
-        cine.agregar_pelicula(pelicula)
-        pelicula.agregar_horario(horario, sala)
+        return cine.agregar_funcion(pelicula, horario, sala)
 
     def consultar_reporte(self, cine, inicio=None, fin=None):
         return cine.generar_reporte(inicio, fin)
 
-def preconfigurar_cine(cine):
+    def programar_semana(self, cine, objetivos, salas=None, inicio=None, dias=7, apertura=11, cierre=23, paso=15):
+        # objetivos: {Pelicula: funciones en el periodo}. Cada día se reparte lo que falta entre los días restantes;
+        # la sala que se libera antes recibe la película con menor parte de su cuota del día cubierta, así que
+        # si no alcanzan las salas todas quedan cortas en la misma proporción.
+        salas = list(salas or cine.salas)
+        inicio = (inicio or datetime.now() + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        pendientes, programadas = {p: n for p, n in objetivos.items() if n > 0}, []
+        orden = {p: i for i, p in enumerate(pendientes)}
+        redondear = lambda minutos: -(-minutos // paso) * paso
+        for dia in range(dias):
+            fecha = inicio + timedelta(days=dia)
+            cuotas = {p: -(-n // (dias - dia)) for p, n in pendientes.items() if n}
+            peliculas = [(0.0, orden[p], p) for p in cuotas]  # (parte cubierta de la cuota, desempate, película)
+            heapq.heapify(peliculas)
+            libres = [(apertura * 60, i) for i in range(len(salas))]  # (minuto desde el que la sala está libre, sala)
+            while peliculas and libres:
+                minuto, i = heapq.heappop(libres)
+                if minuto >= cierre * 60:
+                    continue  # La sala ya no abre otra función este día
+                cubierta, n, pelicula = peliculas[0]
+                horario, sala = fecha + timedelta(minutes=minuto), salas[i]
+                if choque := sala.choque(horario, pelicula.duracion):
+                    # Función ya programada en la sala: se salta hasta que termine su limpieza
+                    heapq.heappush(libres, (max(minuto + paso, redondear(int((choque[1] - fecha).total_seconds()) // 60)), i))
+                    continue
+                if cine.funciones.buscar(pelicula, horario):
+                    heapq.heappush(libres, (minuto + paso, i))
+                    continue
+                programadas.append(cine.agregar_funcion(pelicula, horario, sala))
+                pendientes[pelicula] -= 1
+                if (cubierta := cubierta + 1 / cuotas[pelicula]) < 1 - 1e-9:
+                    heapq.heapreplace(peliculas, (cubierta, n, pelicula))
+                else:
+                    heapq.heappop(peliculas)
+                heapq.heappush(libres, (minuto + redondear(pelicula.duracion + sala.limpieza), i))
+        return programadas, {p: n for p, n in pendientes.items() if n}
+
+OPERACIONES_MEDIDAS = [(Cine, "vender_boleto"), (Cine, "vender_boletos_lote"), (Cine, "cancelar_boleto"), (Cine, "confirmar_reserva"),
+                       (Cine, "retener_asientos"), (Cine, "generar_reporte"), (Cine, "datos_cartelera"), (Cine, "recomendar_funciones"),
+                       (Sala, "ocupar_asientos"), (Sala, "ocupar_lote"), (Sala, "liberar_asientos"), (Sala, "mejores_asientos"),
+                       (InventarioColeccionables, "reservar")]
+_CUBETAS_LATENCIA = 32  # cubeta b: hasta 2**b microsegundos
+
+class _CandadoMedido:
+    __slots__ = ("candado", "metricas")
+
+    def __init__(self, candado, metricas):
+        self.candado, self.metricas = candado, metricas
+
+    def __enter__(self):
+        inicio = time.perf_counter()
+        self.candado.acquire()
+        self.metricas.registrar("espera Sala.candado", time.perf_counter() - inicio)
+
+    def __exit__(self, *excepcion):
+        self.candado.release()
+
+class Metricas:
+    # Apagadas no cuestan nada: activar() reemplaza los métodos medidos por envoltorios y desactivar() devuelve los originales
+    def __init__(self, operaciones=None):
+        self.operaciones = operaciones or OPERACIONES_MEDIDAS
+        self.activa = False
+        self._originales = {}
+        self._candado = threading.RLock()  # reentrante: la señal del perfilador puede llegar con el candado tomado
+        self._perfilador = None
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._candado:
+            self.llamadas, self.errores, self.segundos = defaultdict(int), defaultdict(int), defaultdict(float)
+            self.histogramas = defaultdict(lambda: [0] * _CUBETAS_LATENCIA)  # nombre -> conteo por cubeta de latencia
+            self.perfil = defaultdict(int)  # pila plegada "archivo:función;..." -> muestras
+
+    def registrar(self, nombre, segundos, error=False):
+        cubeta = min(_CUBETAS_LATENCIA - 1, int(segundos * 1e6).bit_length())
+        with self._candado:
+            self.llamadas[nombre] += 1
+            self.segundos[nombre] += segundos
+            self.histogramas[nombre][cubeta] += 1
+            if error:
+                self.errores[nombre] += 1
+
+    def _envolver(self, nombre, metodo):
+        @functools.wraps(metodo)
+        def medido(*args, **kwargs):
+            inicio, error = time.perf_counter(), True
+            try:
+                resultado = metodo(*args, **kwargs)
+                error = False
+                return resultado
+            finally:
+                self.registrar(nombre, time.perf_counter() - inicio, error)
+        return medido
+
+    def activar(self):
+        if self.activa:
+            return self
+        for clase, nombre in self.operaciones:
+            self._originales[(clase, nombre)] = metodo = clase.__dict__[nombre]
+            setattr(clase, nombre, self._envolver(f"{clase.__name__}.{nombre}", metodo))
+        self._originales[(Sala, "candado")] = candado = Sala.__dict__["candado"]
+        setattr(Sala, "candado", lambda sala, horario: _CandadoMedido(candado(sala, horario), self))
+        self.activa = True
+        return self
+
+    def desactivar(self):
+        for (clase, nombre), metodo in self._originales.items():
+            setattr(clase, nombre, metodo)
+        self._originales.clear()
+        self.activa = False
+        self.detener_perfilador()
+
+    def iniciar_perfilador(self, intervalo=0.005, profundidad=12):
+        # Perfilador por muestreo. Desde el hilo principal usa SIGPROF, que toma la muestra entre dos instrucciones;
+        # un hilo muestreador solo despierta cuando otro suelta el GIL y sobrerrepresenta esas líneas.
+        if self._perfilador:
+            return
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, "setitimer"):
+            def al_recibir(numero, marco):
+                marcos = sys._current_frames()
+                marcos[threading.main_thread().ident] = marco
+                self._muestrear(marcos, profundidad)
+            self._perfilador = ("señal", signal.signal(signal.SIGPROF, al_recibir))
+            signal.setitimer(signal.ITIMER_PROF, intervalo, intervalo)
+            return
+        detener = threading.Event()
+
+        def muestrear():
+            propio = threading.get_ident()
+            while not detener.wait(intervalo):
+                self._muestrear({h: m for h, m in sys._current_frames().items() if h != propio}, profundidad)
+
+        hilo = threading.Thread(target=muestrear, daemon=True, name="perfilador")
+        self._perfilador = ("hilo", (hilo, detener))
+        hilo.start()
+
+    def _muestrear(self, marcos, profundidad):
+        for marco in marcos.values():
+            pila = []
+            while marco and len(pila) < profundidad:
+                pila.append(f"{os.path.basename(marco.f_code.co_filename)}:{marco.f_code.co_name}")
+                marco = marco.f_back
+            with self._candado:
+                self.perfil[";".join(reversed(pila))] += 1
+
+    def detener_perfilador(self):
+        if not self._perfilador:
+            return
+        modo, estado = self._perfilador
+        if modo == "señal":
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, estado)
+        else:
+            hilo, detener = estado
+            detener.set()
+            hilo.join()
+        self._perfilador = None
+
+    @staticmethod
+    def _percentil(histograma, q):
+        # Cota superior de la cubeta donde cae el percentil q
+        objetivo, acumulado = q * sum(histograma), 0
+        for cubeta, cantidad in enumerate(histograma):
+            acumulado += cantidad
+            if cantidad and acumulado >= objetivo:
+                return (1 << cubeta) / 1000
+        return 0.0
+
+    def datos(self):
+        with self._candado:
+            return {"operaciones": {nombre: {"llamadas": n, "errores": self.errores[nombre],
+                                             "total_ms": self.segundos[nombre] * 1000, "media_ms": self.segundos[nombre] / n * 1000,
+                                             **{f"p{q}_ms": self._percentil(self.histogramas[nombre], q / 100) for q in (50, 95, 99)},
+                                             "histograma_us": {1 << b: c for b, c in enumerate(self.histogramas[nombre]) if c}}
+                                    for nombre, n in sorted(self.llamadas.items())},
+                    "perfil": dict(sorted(self.perfil.items(), key=lambda x: x[1], reverse=True))}
+
+    def exportar(self, formato="texto"):
+        datos = self.datos()
+        if formato == "json":
+            return json.dumps(datos, indent=2)
+        lineas = [f"{nombre}: {d['llamadas']} llamadas, {d['errores']} errores, media {d['media_ms']:.3f} ms, "
+                  f"p50 <{d['p50_ms']:.3f} ms p95 <{d['p95_ms']:.3f} ms p99 <{d['p99_ms']:.3f} ms"
+                  for nombre, d in datos["operaciones"].items()]
+        if datos["perfil"]:
+            total = sum(datos["perfil"].values())
+            lineas.append(f"Perfil ({total} muestras):")
+            lineas.extend(f" {muestras / total:6.1%} {pila}" for pila, muestras in list(datos["perfil"].items())[:15])
+        return "\n".join(lineas)
+
+METRICAS = Metricas()
+
+ESCENARIOS = {
+    "demo": {"complejos": 1, "salas_por_complejo": 4, "peliculas": 6, "dias": 2},
+    "benchmark": {"complejos": 2, "salas_por_complejo": 10, "peliculas": 10, "dias": 2},
+    "cadena": {"complejos": 20, "salas_por_complejo": 12, "peliculas": 120, "dias": 30},
+    "produccion": {"complejos": 150, "salas_por_complejo": 14, "peliculas": 400, "dias": 95},  # ~1 millón de funciones
+}
+
+GENEROS = ["Acción", "Animación", "Ciencia Ficción", "Comedia", "Drama", "Terror", "Documental"]
+CLASIFICACIONES = ["G", "PG", "PG-13", "R"]
+
+def iterar_funciones(semilla=0, complejos=10, salas_por_complejo=12, peliculas=100, dias=30, inicio=None, limpieza=15):
+    # Genera (pelicula, horario, sala, ocupacion) día por día y en orden de horario, sin armar la cadena completa en memoria
+    azar = random.Random(semilla)
+    inicio = (inicio or datetime.now() + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    salas = []
+    for complejo in range(1, complejos + 1):
+        for n in range(1, salas_por_complejo + 1):
+            premium = azar.random() < 0.15
+            salas.append(Sala(complejo * 1000 + n, azar.randint(6, 9) if premium else azar.randint(10, 30),
+                              azar.randint(8, 12) if premium else azar.randint(14, 30), complejo, limpieza))
+    catalogo = []
+    for n in range(1, peliculas + 1):
+        pelicula = Pelicula(f"Película {n:04d}", azar.choice(GENEROS), azar.randint(80, 175), azar.choice(CLASIFICACIONES),
+                            f"Coleccionable {n:04d}" if azar.random() < 0.3 else None, azar.choice([0, 5, 10, 15]), azar.choice([70, 80, 90, 110]))
+        # Popularidad tipo Zipf y estreno repartido entre dos semanas antes y el final del periodo
+        catalogo.append((pelicula, 0.15 + 0.8 / (1 + n / 8) ** 0.5, azar.randint(-14, max(0, dias - 7))))
+    # Curva diaria: la demanda sube hacia las 20:00
+    curva_hora = [0.45 + 0.55 * math.exp(-((minuto / 60 - 20) / 3) ** 2) for minuto in range(24 * 60)]
+    for dia in range(dias):
+        fecha = inicio + timedelta(days=dia)
+        vigentes = [(p, pop * 0.85 ** ((dia - estreno) // 7)) for p, pop, estreno in catalogo if estreno <= dia < estreno + 56]
+        if not vigentes:
+            continue
+        acumulados = list(itertools.accumulate(pop for _, pop in vigentes))
+        fin_de_semana = 1.25 if fecha.weekday() >= 4 else 1.0
+        del_dia, usados, horarios = [], set(), {}  # usados: (pelicula, minuto), porque una función se identifica por película y horario
+        for sala in salas:
+            minuto = 11 * 60 + 15 * azar.randrange(4)
+            while minuto < 23 * 60:
+                i = bisect.bisect(acumulados, azar.random() * acumulados[-1])
+                pelicula, popularidad = vigentes[i]
+                while (pelicula, minuto) in usados:
+                    minuto += 5
+                if minuto >= 23 * 60:
+                    break
+                usados.add((pelicula, minuto))
+                ocupacion = min(1.0, popularidad * curva_hora[minuto] * fin_de_semana * (0.75 + 0.5 * azar.random()))
+                del_dia.append((minuto, sala.numero, pelicula, sala, ocupacion))
+                minuto += -(-(pelicula.duracion + limpieza) // 15) * 15
+        del_dia.sort()  # (minuto, numero de sala) nunca se repite, así que no llega a comparar películas
+        for minuto, _, pelicula, sala, ocupacion in del_dia:
+            horario = horarios.get(minuto) or horarios.setdefault(minuto, fecha + timedelta(minutes=minuto))
+            yield pelicula, horario, sala, ocupacion
+
+def generar_cadena(cine, semilla=0, filtro=None, **escenario):
+    # Carga una cadena sintética en `cine`; la ocupación de cada función se materializa recién cuando se toca su mapa.
+    # Con filtro(sala) carga solo esas salas, con la misma ocupación que tendrían en la cadena completa
+    azar, salas = random.Random(semilla ^ 0x5A5A), set()
+    # Millones de objetos nuevos que no forman ciclos: el recolector solo agregaría pasadas completas
+    recolector = gc.isenabled()
+    gc.disable()
+    try:
+        for pelicula, horario, sala, ocupacion in iterar_funciones(semilla, **escenario):
+            semilla_mapa = azar.getrandbits(63)
+            if filtro and not filtro(sala):
+                continue
+            if sala not in salas:
+                salas.add(sala)
+                cine.agregar_sala(sala)
+            cine.agregar_funcion(pelicula, horario, sala)
+            sala.precargar(horario, round(ocupacion * sala.filas * sala.columnas), semilla_mapa)
+    finally:
+        if recolector:
+            gc.enable()
+    return cine
+
+def preconfigurar_cine(cine, semilla=None, escenario=None):
+    if escenario:
+        return generar_cadena(cine, semilla or 0, **(ESCENARIOS[escenario] if isinstance(escenario, str) else escenario))
+    azar = random.Random(semilla)
     salas = [Sala(1), Sala(2)]
     for sala in salas:
         cine.agregar_sala(sala)
     peliculas = [
-        Pelicula("Inception", "Ciencia Ficción", 148, "PG-13", coleccionable="Caja de Inception", precio_coleccionable=10),
-        Pelicula("The Lion King", "Animación", 118, "G", coleccionable="Aviso de The Lion King", precio_coleccionable=0)
+        Pelicula("Inception", "Ciencia Ficción", 148, "PG-13", coleccionable="Caja de Inception", precio_coleccionable=10, precio_boleto=90),
+        Pelicula("The Lion King", "Animación", 118, "G", coleccionable="Aviso de The Lion King", precio_coleccionable=0, precio_boleto=80)
     ]
     horarios = [
         (datetime(2025, 10, 8, 19, 0), salas[0]),  # 7:00 PM
@@ -185,9 +2348,534 @@ def preconfigurar_cine(cine):
         cine.agregar_pelicula(pel)
         for h, s in pel.horarios:
             asientos_total = s.filas * s.columnas
-            num_ocupados = random.randint(0, asientos_total)
-            asientos_ocupados = random.sample(list(s.horarios_asientos[h].keys()), num_ocupados)
-            s.ocupar_asientos(h, asientos_ocupados)
+            num_ocupados = azar.randint(0, asientos_total)
+            asientos_ocupados = azar.sample(range(asientos_total), num_ocupados)
+            s.ocupar_asientos(h, [s.etiqueta(i) for i in asientos_ocupados])
+
+def medir_bitacora(directorio, ventas=100000, lote=256):
+    # Ventas sostenidas con y sin bitácora, tiempo de instantánea y de recuperación
+    resultados = {}
+    for con_bitacora in (False, True):
+        cine, base = Cine("Medición"), datetime.now() + timedelta(days=1)
+        pelicula, cliente = Pelicula("Medición", "Prueba", 90, "G", precio_boleto=50), Cliente("Carga", "carga@cine.com")
+        funciones = [cine.agregar_funcion(pelicula, base + timedelta(minutes=i), Sala(i, 20, 30)) for i in range(ventas // 600 + 1)]
+        if con_bitacora:
+            cine.activar_bitacora(directorio, lote=lote)
+        inicio = time.perf_counter()
+        for i in range(ventas):
+            f = funciones[i // 600]
+            cine.vender_boleto(cliente, pelicula, f.horario, [f.sala.etiqueta(i % 600)])
+        resultados["ventas_por_segundo_con_bitacora" if con_bitacora else "ventas_por_segundo_sin_bitacora"] = ventas / (time.perf_counter() - inicio)
+    cine.bitacora.sincronizar()
+    resultados["bytes_bitacora"] = os.path.getsize(Bitacora.ruta_segmento(directorio, cine.bitacora.segmento))
+    inicio = time.perf_counter()
+    cine.guardar_instantanea()
+    resultados["instantanea_s"] = time.perf_counter() - inicio
+    for i in range(ventas // 10):
+        cine.cancelar_boleto(next(iter(cine.ventas)).codigo)
+    cine.bitacora.cerrar()
+    inicio = time.perf_counter()
+    recuperado = Cine.recuperar(directorio, "Medición")
+    resultados["recuperacion_s"] = time.perf_counter() - inicio
+    recuperado.bitacora.cerrar()
+    return resultados
+
+class ServicioCine:
+    # Protocolo de líneas: cada petición y cada respuesta es un objeto JSON en una línea
+    def __init__(self, cine, hilos=8):
+        self.cine = cine
+        self.lecturas = {"cartelera": self.cartelera, "asientos": self.asientos, "reporte": self.reporte, "boleto": self.boleto,
+                         "recomendar": self.recomendar, "metricas": self.metricas,
+                         "ingresar": self.ingresar}  # el escaneo es corto y seguro entre hilos: no pasa por el pool
+        self.escrituras = {"comprar": self.comprar, "cancelar": self.cancelar}
+        # Las escrituras (candados por función, fsync de la bitácora) corren en hilos para no frenar las lecturas
+        self._hilos = ThreadPoolExecutor(hilos, thread_name_prefix="venta")
+        self._conexiones = {}  # tarea -> escritor de cada conexión abierta
+        self.servidor = None
+
+    async def iniciar(self, host="127.0.0.1", puerto=8765):
+        self.servidor = await asyncio.start_server(self.atender, host, puerto, limit=1 << 16, backlog=4096)
+        return self.servidor.sockets[0].getsockname()[1]
+
+    async def detener(self):
+        self.servidor.close()
+        for escritor in list(self._conexiones.values()):
+            escritor.close()
+        await asyncio.gather(*self._conexiones, return_exceptions=True)
+        await self.servidor.wait_closed()
+        self._hilos.shutdown()
+
+    async def atender(self, lector, escritor):
+        self._conexiones[asyncio.current_task()] = escritor
+        try:
+            while linea := await lector.readline():
+                escritor.write(json.dumps(await self.despachar(linea), default=str).encode() + b"\n")
+                await escritor.drain()
+        except ValueError:
+            # Línea más larga que el límite del lector: el resto de la petición llegaría como otra línea, así que se
+            # responde el error y se cierra la conexión
+            escritor.write(json.dumps({"ok": False, "error": "Petición demasiado larga."}).encode() + b"\n")
+            await escritor.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self._conexiones[asyncio.current_task()]
+            escritor.close()
+
+    @staticmethod
+    def _peticion(peticion):
+        if not isinstance(peticion, dict):
+            raise ValueError("La petición debe ser un objeto JSON.")
+        return peticion
+
+    async def despachar(self, linea):
+        try:
+            peticion = self._peticion(json.loads(linea))
+            if operacion := self.lecturas.get(peticion.get("op")):
+                return {"ok": True, "resultado": operacion(peticion)}
+            if operacion := self.escrituras.get(peticion.get("op")):
+                resultado = await asyncio.get_running_loop().run_in_executor(self._hilos, operacion, peticion)
+                return {"ok": True, "resultado": resultado}
+            raise ValueError(f"Operación desconocida: {peticion.get('op')}.")
+        except RecursionError:
+            return {"ok": False, "error": "Petición demasiado anidada."}
+        except (ValueError, KeyError, TypeError) as e:
+            return {"ok": False, "error": str(e)}
+        except Exception as e:
+            # Ninguna petición puede tirar la conexión: lo inesperado también vuelve como respuesta
+            return {"ok": False, "error": f"Error interno: {type(e).__name__}."}
+
+    def ejecutar(self, peticion):
+        # Sin bucle de eventos: para quien ya corre en su propio hilo o proceso
+        try:
+            self._peticion(peticion)
+            if not (operacion := self.lecturas.get(peticion.get("op")) or self.escrituras.get(peticion.get("op"))):
+                raise ValueError(f"Operación desconocida: {peticion.get('op')}.")
+            return {"ok": True, "resultado": operacion(peticion)}
+        except (ValueError, KeyError, TypeError) as e:
+            return {"ok": False, "error": str(e)}
+        except Exception as e:
+            return {"ok": False, "error": f"Error interno: {type(e).__name__}."}
+
+    @staticmethod
+    def _numero(peticion, clave, defecto, minimo, maximo, tipos=(int, float)):
+        valor = peticion.get(clave, defecto)
+        if isinstance(valor, bool) or not isinstance(valor, tipos) or not minimo <= valor <= maximo:
+            raise ValueError(f"{clave} debe ser un número entre {minimo} y {maximo}.")
+        return valor
+
+    def _funcion(self, peticion):
+        if not (funcion := self.cine.funciones.obtener(peticion["funcion"])):
+            raise ValueError("Función no encontrada.")
+        return funcion
+
+    @staticmethod
+    def _boleto(boleto):
+        return {"codigo": boleto.codigo, "pelicula": boleto.pelicula.titulo, "horario": boleto.horario.isoformat(),
+                "asientos": boleto.asientos, "coleccionable": boleto.coleccionable, "total": boleto.total}
+
+    def cartelera(self, peticion):
+        return self.cine.datos_cartelera()
+
+    def asientos(self, peticion):
+        funcion = self._funcion(peticion)
+        sala = funcion.sala
+        mapa = sala.mapa_asientos(funcion.horario)
+        return {"funcion": funcion.id, "sala": sala.numero, "ocupacion": round(sala.get_occupancy(funcion.horario), 2),
+                "filas": [sala.nombre_fila(i) + " " + "".join("X" if x else "." for x in mapa[i * sala.columnas:(i + 1) * sala.columnas])
+                          for i in range(sala.filas)]}
+
+    def recomendar(self, peticion):
+        funcion = self._funcion(peticion)
+        return [{"funcion": f.id, "pelicula": f.pelicula.titulo, "horario": f.horario.isoformat(), "sala": f.sala.numero,
+                 "ocupacion": round(f.sala.get_occupancy(f.horario), 2)}
+                for f in self.cine.recomendar_funciones(funcion.pelicula, funcion.horario, self._numero(peticion, "k", 2, 1, 100, int),
+                                                        self._numero(peticion, "horas", 3, 0, 24 * 7), peticion.get("similares", True))]
+
+    def ingresar(self, peticion):
+        if "funcion" in peticion:
+            funcion = self._funcion(peticion)
+            return self.cine.registrar_ingreso(peticion["codigo"], peticion.get("puerta", 1), funcion.pelicula, funcion.horario)
+        return self.cine.registrar_ingreso(peticion["codigo"], peticion.get("puerta", 1))
+
+    def metricas(self, peticion):
+        if "activar" in peticion:
+            METRICAS.activar() if peticion["activar"] else METRICAS.desactivar()
+        if "perfil" in peticion:
+            METRICAS.iniciar_perfilador() if peticion["perfil"] else METRICAS.detener_perfilador()
+        return {"activa": METRICAS.activa, **METRICAS.datos()}
+
+    def reporte(self, peticion):
+        inicio, fin = (datetime.fromisoformat(peticion[k]) if peticion.get(k) else None for k in ("inicio", "fin"))
+        return self.cine.generar_reporte(inicio, fin)
+
+    def boleto(self, peticion):
+        if not (boleto := self.cine.ventas.buscar(peticion["codigo"])):
+            raise ValueError("Boleto no encontrado.")
+        return self._boleto(boleto)
+
+    def comprar(self, peticion):
+        funcion, correo = self._funcion(peticion), peticion["correo"]
+        cliente = self.cine.clientes.get(correo) or Cliente(peticion.get("nombre", correo), correo)
+        if asientos := peticion.get("asientos"):
+            boleto = self.cine.vender_boleto(cliente, funcion.pelicula, funcion.horario, asientos, peticion.get("coleccionable", False))
+        else:
+            reserva = self.cine.retener_mejores(cliente, funcion.pelicula, funcion.horario, peticion.get("cantidad", 1))
+            boleto = self.cine.confirmar_reserva(reserva.id, peticion.get("coleccionable", False))
+        return self._boleto(boleto)
+
+    def cancelar(self, peticion):
+        return self.cine.cancelar_boleto(peticion["codigo"])
+
+async def cliente_carga(host, puerto, conexiones=100, peticiones=50, proporcion_compras=0.2, semilla=0):
+    # Cliente de carga sin dependencias externas: abre `conexiones` sockets y manda `peticiones` por cada uno
+    latencias, errores = defaultdict(list), defaultdict(int)
+
+    async def sesion(n):
+        rng = random.Random(semilla * 100003 + n)
+        lector, escritor = await asyncio.open_connection(host, puerto, limit=1 << 20)
+        async def pedir(peticion):
+            inicio = time.perf_counter()
+            escritor.write(json.dumps(peticion).encode() + b"\n")
+            await escritor.drain()
+            respuesta = json.loads(await lector.readline())
+            latencias[peticion["op"]].append(time.perf_counter() - inicio)
+            if not respuesta["ok"]:
+                errores[peticion["op"]] += 1
+            return respuesta
+        funciones = [f["id"] for p in (await pedir({"op": "cartelera"}))["resultado"] for f in p["funciones"] if not f["llena"]]
+        for _ in range(peticiones - 1):
+            funcion, sorteo = rng.choice(funciones), rng.random()
+            if sorteo < proporcion_compras:
+                await pedir({"op": "comprar", "funcion": funcion, "cantidad": rng.randint(1, 4), "correo": f"carga{n}@cine.com"})
+            elif sorteo < 0.6:
+                await pedir({"op": "asientos", "funcion": funcion})
+            else:
+                await pedir({"op": "cartelera"})
+        escritor.close()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(sesion(n) for n in range(conexiones)))
+    duracion = time.perf_counter() - inicio
+    total = sum(map(len, latencias.values()))
+    return {"conexiones": conexiones, "peticiones": total, "peticiones_por_segundo": total / duracion,
+            "errores": dict(errores),
+            "p99_ms": {op: sorted(l)[int(len(l) * 0.99)] * 1000 for op, l in latencias.items()}}
+
+async def probar_servicio(cine, conexiones=1000, peticiones=20):
+    servicio = ServicioCine(cine)
+    puerto = await servicio.iniciar(puerto=0)
+    try:
+        return await cliente_carga("127.0.0.1", puerto, conexiones, peticiones)
+    finally:
+        await servicio.detener()
+
+async def servir(cine, host="127.0.0.1", puerto=8765):
+    servicio = ServicioCine(cine)
+    puerto = await servicio.iniciar(host, puerto)
+    print(f"Servicio de {cine.nombre} escuchando en {host}:{puerto}")
+    async with servicio.servidor:
+        await servicio.servidor.serve_forever()
+
+def _atender_fragmento(conexion, fragmento, fragmentos, semilla, escenario, inicio):
+    # Proceso de un fragmento: carga solo los complejos que le tocan y atiende lotes de peticiones hasta recibir None
+    cine = generar_cadena(Cine(f"Fragmento {fragmento}"), semilla, inicio=inicio,
+                          filtro=lambda sala: sala.complejo % fragmentos == fragmento, **escenario)
+    servicio = ServicioCine(cine, hilos=1)
+    conexion.send(len(cine.funciones))
+    try:
+        while (peticiones := conexion.recv()) is not None:
+            respuestas = []
+            for peticion in peticiones:
+                # Una petición mala responde un error; si escapara, el proceso terminaría y con él todo el fragmento
+                try:
+                    if peticion.get("op") == "reporte_parcial":
+                        respuestas.append({"ok": True, "resultado": cine.reporte.consultar(peticion["inicio"], peticion["fin"])})
+                    else:
+                        respuestas.append(servicio.ejecutar(peticion))
+                except Exception as e:
+                    respuestas.append({"ok": False, "error": f"Error interno: {type(e).__name__}."})
+            conexion.send(respuestas)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        servicio._hilos.shutdown()
+
+class MotorDistribuido:
+    # Reparte la cadena entre procesos por complejo. Los ids de función son globales: id local * fragmentos + fragmento,
+    # así el router sabe a qué proceso va una venta sin consultar a nadie
+    def __init__(self, procesos=2, semilla=0, escenario="cadena", inicio=None):
+        escenario = ESCENARIOS[escenario] if isinstance(escenario, str) else escenario
+        inicio = inicio or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        # fork: el hijo no vuelve a importar este archivo, que no tiene nombre de módulo importable
+        contexto = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+        self.fragmentos = procesos
+        self._conexiones, self._procesos, self._candados = [], [], []
+        self._codigos = {}  # código de boleto -> fragmento que lo vendió
+        self.caidos = set()  # fragmentos cuyo proceso dejó de responder
+        for fragmento in range(procesos):
+            padre, hijo = contexto.Pipe()
+            proceso = contexto.Process(target=_atender_fragmento, args=(hijo, fragmento, procesos, semilla, escenario, inicio),
+                                       name=f"fragmento-{fragmento}", daemon=True)
+            proceso.start()
+            hijo.close()
+            self._conexiones.append(padre)
+            self._procesos.append(proceso)
+            self._candados.append(threading.Lock())
+        cantidades = [conexion.recv() for conexion in self._conexiones]
+        self.funciones = [local * procesos + fragmento for fragmento, n in enumerate(cantidades) for local in range(1, n + 1)]
+
+    def cerrar(self):
+        for conexion, candado in zip(self._conexiones, self._candados):
+            with candado:
+                try:
+                    conexion.send(None)
+                except OSError:
+                    pass
+        for proceso in self._procesos:
+            proceso.join(5)
+            if proceso.is_alive():
+                proceso.terminate()
+        for conexion in self._conexiones:
+            conexion.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.cerrar()
+
+    def _global(self, fragmento, id_local):
+        return id_local * self.fragmentos + fragmento
+
+    def _enviar(self, lotes):
+        # lotes: fragmento -> [peticiones]. Se manda a todos antes de esperar a ninguno, así los procesos trabajan a la vez.
+        # Los candados se toman en orden de fragmento para que dos lotes simultáneos no se bloqueen entre sí
+        fragmentos = sorted(lotes)
+        for fragmento in fragmentos:
+            self._candados[fragmento].acquire()
+        try:
+            enviados = []
+            for fragmento in fragmentos:
+                if fragmento not in self.caidos:
+                    try:
+                        self._conexiones[fragmento].send(lotes[fragmento])
+                        enviados.append(fragmento)
+                    except OSError:
+                        self.caidos.add(fragmento)
+            respuestas = {}
+            for fragmento in enviados:
+                try:
+                    respuestas[fragmento] = self._conexiones[fragmento].recv()
+                except (EOFError, OSError):
+                    self.caidos.add(fragmento)
+            # Lo que iba a un fragmento caído vuelve como error, sin frenar al resto del lote
+            for fragmento in fragmentos:
+                if fragmento not in respuestas:
+                    respuestas[fragmento] = [{"ok": False, "error": f"El fragmento {fragmento} no responde."} for _ in lotes[fragmento]]
+            return respuestas
+        finally:
+            for fragmento in fragmentos:
+                self._candados[fragmento].release()
+
+    def _a_todos(self, peticion):
+        return [respuestas[0] for _, respuestas in sorted(self._enviar({f: [peticion] for f in range(self.fragmentos)}).items())]
+
+    def _resultados(self, peticion):
+        # Para lo que junta a todos los fragmentos: sin uno de ellos el resultado quedaría incompleto
+        respuestas = self._a_todos(peticion)
+        if fallida := next((r for r in respuestas if not r["ok"]), None):
+            raise ValueError(fallida["error"])
+        return [r["resultado"] for r in respuestas]
+
+    def _destino(self, peticion):
+        if "funcion" in peticion:
+            fragmento, id_local = peticion["funcion"] % self.fragmentos, peticion["funcion"] // self.fragmentos
+            return fragmento, {**peticion, "funcion": id_local}
+        if "codigo" in peticion:
+            codigo = str(peticion["codigo"]).upper()
+            if (fragmento := self._codigos.get(codigo)) is None:
+                # Boleto que no pasó por este router: se busca en todos los fragmentos
+                encontrados = [f for f, r in enumerate(self._a_todos({"op": "boleto", "codigo": codigo})) if r["ok"]]
+                if not encontrados:
+                    raise ValueError("Boleto no encontrado.")
+                fragmento = self._codigos[codigo] = encontrados[0]
+            return fragmento, peticion
+        raise ValueError(f"La operación {peticion.get('op')} no indica función ni boleto.")
+
+    def ejecutar(self, peticiones):
+        # Lote de peticiones del protocolo de ServicioCine; devuelve las respuestas en el mismo orden
+        respuestas, lotes, posiciones = [None] * len(peticiones), defaultdict(list), defaultdict(list)
+        for i, peticion in enumerate(peticiones):
+            try:
+                if ServicioCine._peticion(peticion).get("op") == "cartelera":
+                    respuestas[i] = {"ok": True, "resultado": self.datos_cartelera()}
+                    continue
+                if peticion.get("op") == "reporte":
+                    inicio, fin = (datetime.fromisoformat(peticion[k]) if peticion.get(k) else None for k in ("inicio", "fin"))
+                    respuestas[i] = {"ok": True, "resultado": self.generar_reporte(inicio, fin)}
+                    continue
+                fragmento, local = self._destino(peticion)
+            except (ValueError, KeyError, TypeError) as e:
+                respuestas[i] = {"ok": False, "error": str(e)}
+                continue
+            lotes[fragmento].append(local)
+            posiciones[fragmento].append(i)
+        for fragmento, resultados in self._enviar(lotes).items():
+            for i, respuesta in zip(posiciones[fragmento], resultados):
+                respuestas[i] = self._traducir(fragmento, peticiones[i], respuesta)
+        return respuestas
+
+    def _traducir(self, fragmento, peticion, respuesta):
+        if respuesta["ok"]:
+            if peticion["op"] == "comprar":
+                self._codigos[respuesta["resultado"]["codigo"]] = fragmento
+            elif peticion["op"] == "cancelar":
+                self._codigos.pop(str(peticion["codigo"]).upper(), None)
+            elif peticion["op"] in ("asientos", "recomendar"):
+                for datos in respuesta["resultado"] if peticion["op"] == "recomendar" else [respuesta["resultado"]]:
+                    datos["funcion"] = self._global(fragmento, datos["funcion"])
+        return respuesta
+
+    def _uno(self, peticion):
+        respuesta = self.ejecutar([peticion])[0]
+        if not respuesta["ok"]:
+            raise ValueError(respuesta["error"])
+        return respuesta["resultado"]
+
+    def vender_boleto(self, funcion, correo, asientos=None, cantidad=1, coleccionable=False, nombre=None):
+        return self._uno({"op": "comprar", "funcion": funcion, "correo": correo, "nombre": nombre or correo,
+                          "asientos": asientos, "cantidad": cantidad, "coleccionable": coleccionable})
+
+    def cancelar_boleto(self, codigo):
+        return self._uno({"op": "cancelar", "codigo": codigo})
+
+    def generar_reporte(self, inicio=None, fin=None):
+        boletos, vistas, concurrencia, total_por_sala = 0, defaultdict(int), defaultdict(int), defaultdict(int)
+        for b, v, c, t in self._resultados({"op": "reporte_parcial", "inicio": inicio or datetime.min, "fin": fin or datetime.max}):
+            boletos += b
+            for destino, origen in ((vistas, v), (concurrencia, c), (total_por_sala, t)):
+                for clave, cantidad in origen.items():
+                    destino[clave] += cantidad
+        return Cine.formatear_reporte(boletos, vistas, concurrencia, total_por_sala)
+
+    def datos_cartelera(self):
+        # Una película puede proyectarse en varios fragmentos: se juntan sus funciones en orden de horario
+        peliculas = {}
+        for fragmento, resultado in enumerate(self._resultados({"op": "cartelera"})):
+            for datos in resultado:
+                pelicula = peliculas.setdefault(datos["titulo"], {"titulo": datos["titulo"], "informacion": datos["informacion"], "funciones": []})
+                pelicula["funciones"].extend({**f, "id": self._global(fragmento, f["id"])} for f in datos["funciones"])
+        for pelicula in peliculas.values():
+            pelicula["funciones"].sort(key=lambda f: (f["horario"], f["sala"]))
+        return list(peliculas.values())
+
+def ejecutar_benchmark_distribuido(procesos=(1, 2, 4), operaciones=200000, escenario="cadena", semilla=0, lote=256,
+                                   proporcion_cancelaciones=0.2):
+    # Misma carga para cada cantidad de procesos: lotes de compras y cancelaciones repartidas por el router
+    base = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    resultados = {"fecha": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                  "nucleos": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+                  "configuracion": {"operaciones": operaciones, "escenario": escenario, "semilla": semilla, "lote": lote},
+                  "procesos": {}}
+    for n in procesos:
+        inicio_carga = time.perf_counter()
+        with MotorDistribuido(n, semilla, escenario, base) as motor:
+            carga = time.perf_counter() - inicio_carga
+            azar, vendidos, fallos = random.Random(semilla), [], 0
+            inicio = time.perf_counter()
+            for hechas in range(0, operaciones, lote * n):
+                peticiones = []
+                for _ in range(min(lote * n, operaciones - hechas)):
+                    if vendidos and azar.random() < proporcion_cancelaciones:
+                        i = azar.randrange(len(vendidos))
+                        vendidos[i], vendidos[-1] = vendidos[-1], vendidos[i]
+                        peticiones.append({"op": "cancelar", "codigo": vendidos.pop()})
+                    else:
+                        peticiones.append({"op": "comprar", "funcion": azar.choice(motor.funciones), "cantidad": azar.randint(1, 4),
+                                           "correo": f"cliente{azar.randrange(500)}@benchmark.com", "coleccionable": azar.random() < 0.3})
+                for peticion, respuesta in zip(peticiones, motor.ejecutar(peticiones)):
+                    if not respuesta["ok"]:
+                        fallos += 1
+                    elif peticion["op"] == "comprar":
+                        vendidos.append(respuesta["resultado"]["codigo"])
+            duracion = time.perf_counter() - inicio
+            resultados["procesos"][n] = {"carga_s": carga, "operaciones_por_segundo": operaciones / duracion, "fallos": fallos,
+                                         "funciones": len(motor.funciones)}
+    referencia = resultados["procesos"][procesos[0]]["operaciones_por_segundo"]
+    for datos in resultados["procesos"].values():
+        datos["aceleracion"] = datos["operaciones_por_segundo"] / referencia
+    return resultados
+
+MEZCLA_BENCHMARK = {"comprar": 0.45, "cancelar": 0.15, "buscar": 0.2, "cartelera": 0.1, "reporte": 0.1}
+
+def _percentil(ordenadas, q):
+    return ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))] if ordenadas else 0.0
+
+def ejecutar_benchmark(operaciones=20000, mezcla=None, escenario="benchmark", clientes=500, semilla=0, salida=None):
+    # Todo lo que decide la carga sale de un Random con semilla: dos corridas con la misma semilla hacen las mismas operaciones
+    mezcla, azar = mezcla or MEZCLA_BENCHMARK, random.Random(semilla)
+    escenario = ESCENARIOS[escenario] if isinstance(escenario, str) else escenario
+    base = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    cine = generar_cadena(Cine("Benchmark"), semilla, inicio=base, **escenario)
+    lista_funciones = list(cine.funciones)
+    lista_clientes = [Cliente(f"Cliente {n}", f"cliente{n}@benchmark.com") for n in range(clientes)]
+    vendidos, latencias, fallos = [], defaultdict(list), defaultdict(int)
+    nombres, pesos = list(mezcla), list(mezcla.values())
+
+    def comprar():
+        funcion = azar.choice(lista_funciones)
+        asientos = funcion.sala.mejores_asientos(funcion.horario, azar.randint(1, 4))
+        vendidos.append(cine.vender_boleto(azar.choice(lista_clientes), funcion.pelicula, funcion.horario, asientos, azar.random() < 0.3).codigo)
+
+    def cancelar():
+        if not vendidos:
+            raise ValueError("No hay boletos para cancelar.")
+        i = azar.randrange(len(vendidos))
+        vendidos[i], vendidos[-1] = vendidos[-1], vendidos[i]
+        cine.cancelar_boleto(vendidos.pop())
+
+    def buscar():
+        cine.ventas.buscar(azar.choice(vendidos) if vendidos else "")
+
+    def reporte():
+        inicio = base + timedelta(days=azar.randrange(escenario["dias"]), hours=azar.randint(10, 22))
+        cine.generar_reporte(inicio, inicio + timedelta(hours=azar.randint(1, 12)))
+
+    acciones = {"comprar": comprar, "cancelar": cancelar, "buscar": buscar, "reporte": reporte, "cartelera": cine.mostrar_cartelera}
+    with open(os.devnull, "w") as nulo:
+        salida_original, sys.stdout = sys.stdout, nulo
+        try:
+            inicio_total = time.perf_counter()
+            for nombre in azar.choices(nombres, pesos, k=operaciones):
+                inicio = time.perf_counter()
+                try:
+                    acciones[nombre]()
+                except ValueError:
+                    fallos[nombre] += 1
+                latencias[nombre].append(time.perf_counter() - inicio)
+            duracion = time.perf_counter() - inicio_total
+        finally:
+            sys.stdout = salida_original
+    resultados = {"fecha": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                  "configuracion": {"operaciones": operaciones, "mezcla": mezcla, "escenario": escenario,
+                                    "funciones": len(lista_funciones), "clientes": clientes, "semilla": semilla},
+                  "operaciones_por_segundo": operaciones / duracion, "boletos_vendidos": len(cine.ventas), "operaciones": {}}
+    for nombre, valores in sorted(latencias.items()):
+        valores.sort()
+        resultados["operaciones"][nombre] = {"cantidad": len(valores), "fallos": fallos[nombre], "por_segundo": len(valores) / sum(valores),
+                                             **{f"p{q}_ms": _percentil(valores, q / 100) * 1000 for q in (50, 95, 99)}}
+    if salida:
+        with open(salida, "w") as archivo:
+            json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+    return resultados
+
+def comparar_benchmarks(anterior, actual):
+    # Razón actual/anterior de cada percentil: > 1 es más lento que antes
+    with open(anterior) as a, open(actual) as b:
+        viejo, nuevo = json.load(a)["operaciones"], json.load(b)["operaciones"]
+    return {op: {k: nuevo[op][k] / viejo[op][k] for k in ("p50_ms", "p95_ms", "p99_ms") if viejo[op][k]}
+            for op in viejo.keys() & nuevo.keys()}
 
 def menu_cliente(cine, cliente):
     while True:
@@ -206,28 +2894,39 @@ def menu_cliente(cine, cliente):
                 horario, sala = pel.horarios[idx_hor]
                 if sala.get_occupancy(horario) >= 80:
                     print("Alta ocupación. Alternativas:")
-                    for h, o in pel.get_alternative_horarios(horario)[:2]:
-                        print(f" - {h.strftime('%I:%M %p')} ({o:.2f}%)")
+                    for f in cine.recomendar_funciones(pel, horario):
+                        print(f" - {f.pelicula.titulo} {f.horario.strftime('%I:%M %p')} en Sala {f.sala.numero} ({f.sala.get_occupancy(f.horario):.2f}%)")
                     if input("¿Continuar? (s/n): ").lower() != 's':
                         continue
                 if sala.is_full(horario):
-                    print("Sala llena. Elige otro horario.")
+                    print("Sala llena.")
+                    if input("¿Entrar en la lista de espera? Se compra solo al liberarse lugar (s/n): ").lower() == 's':
+                        cantidad = int(input("¿Cuántos asientos?: "))
+                        cine.esperar_funcion(cliente, pel, horario, cantidad, comprar=True,
+                                             aviso=lambda e: print(f"\nLista de espera: {e.boleto.mostrar_detalles()}"))
+                        print("Estás en la lista de espera.")
                     continue
                 sala.mostrar_asientos(horario)
                 # Nuevo: Permitir al usuario elegir asientos
-                asientos_str = input("Ingresa los asientos (ej. A1 B2, separados por espacio): ").upper().split()
+                asientos_str = input("Ingresa los asientos (ej. A1 B2, separados por espacio) o cuántos quieres: ").upper().split()
+                if len(asientos_str) == 1 and asientos_str[0].isdigit():
+                    asientos_str = sala.mejores_asientos(horario, int(asientos_str[0]))
+                    print(f"Mejores asientos disponibles: {' '.join(asientos_str)}")
                 # Validar formato de los asientos
                 for asiento in asientos_str:
-                    if not (len(asiento) >= 2 and asiento[0].isalpha() and asiento[1:].isdigit() and
-                            ord(asiento[0]) - 65 < sala.filas and 1 <= int(asiento[1:]) <= sala.columnas):
-                        raise ValueError(f"Asiento {asiento} inválido.")
-                coleccionable = False
-                if pel.coleccionable:
-                    costo = "gratis" if pel.precio_coleccionable == 0 else f"por ${pel.precio_coleccionable} extra"
-                    print(f"¡Hey! Para esta película, puedes obtener el coleccionable '{pel.coleccionable}' {costo}.")
-                    if input("¿Quieres agregarlo? (s/n): ").lower() == 's':
-                        coleccionable = True
-                boleto = cliente.comprar_boleto(cine, pel, horario, asientos_str, coleccionable)
+                    sala.indice(asiento)
+                reserva = cine.retener_asientos(cliente, pel, horario, asientos_str)
+                print("Asientos retenidos por 5 minutos.")
+                try:
+                    coleccionable = False
+                    if pel.coleccionable:
+                        costo = "gratis" if pel.precio_coleccionable == 0 else f"por ${pel.precio_coleccionable} extra"
+                        print(f"¡Hey! Para esta película, puedes obtener el coleccionable '{pel.coleccionable}' {costo}.")
+                        if input("¿Quieres agregarlo? (s/n): ").lower() == 's':
+                            coleccionable = True
+                    boleto = cine.confirmar_reserva(reserva.id, coleccionable)
+                finally:
+                    cine.liberar_reserva(reserva.id)  # Sin efecto si la reserva ya se confirmó
                 print("Compra exitosa!", boleto.mostrar_detalles())
             except Exception as e:
                 print(f"Error: {e}")
@@ -248,7 +2947,7 @@ def menu_cliente(cine, cliente):
 
 def menu_admin(cine, admin):
     while True:
-        print("\nMenú Admin: 1. Consultar reporte 2. Salir")
+        print("\nMenú Admin: 1. Consultar reporte 2. Programar semana 3. Salir")
         if (opcion := input("Elige: ")) == "1":
             reporte = admin.consultar_reporte(cine)
             if "mensaje" in reporte:
@@ -257,15 +2956,85 @@ def menu_admin(cine, admin):
                 print(f"Película más vista: {reporte['pelicula_mas_vista']}")
                 for h, c in reporte['horarios_mas_concurridos']:
                     print(f" - {h}: {c} entradas")
+                for dia, total in cine.reporte_ingresos().items():
+                    print(f"Ingresos {dia:%Y-%m-%d}: ${total}")
+                for titulo, datos in cine.analitica.coleccionables().items():
+                    print(f"Coleccionable de {titulo}: {datos['tasa']:.0%} de {datos['boletos']} boletos (${datos['ingresos']})")
+                for (titulo, complejo), disponibles in cine.inventario.bajo_stock().items():
+                    print(f"Quedan {disponibles} coleccionables de {titulo}" + (f" en el complejo {complejo}" if complejo is not None else ""))
         elif opcion == "2":
+            try:
+                objetivos = {pel: int(input(f"Funciones de {pel.titulo} en la semana: ") or 0) for pel in cine.cartelera}
+                programadas, pendientes = admin.programar_semana(cine, objetivos)
+                print(f"{len(programadas)} funciones programadas.")
+                for pel, n in pendientes.items():
+                    print(f" - Sin lugar para {n} funciones de {pel.titulo}")
+            except ValueError as e:
+                print(f"Error: {e}")
+        elif opcion == "3":
             break
         else:
             print("Opción inválida.")
 
-def main():
+def abrir_cine(directorio="datos_cine"):
+    if os.path.exists(os.path.join(directorio, "instantanea.bin")):
+        return Cine.recuperar(directorio, "Cine Estrella")
     cine = Cine("Cine Estrella")
     preconfigurar_cine(cine)
-    admin, cliente = Administrador("Admin", "A001", "admin@cine.com"), Cliente("Cliente Ejemplo", "cliente@example.com")
+    cine.activar_bitacora(directorio)
+    return cine
+
+def main(argumentos=None):
+    argumentos = sys.argv[1:] if argumentos is None else argumentos
+    if argumentos[:1] == ["benchmark"]:
+        parser = argparse.ArgumentParser(prog="benchmark")
+        parser.add_argument("--operaciones", type=int, default=20000)
+        parser.add_argument("--escenario", default="benchmark", choices=sorted(ESCENARIOS))
+        parser.add_argument("--semilla", type=int, default=0)
+        parser.add_argument("--salida", default="benchmark.json")
+        parser.add_argument("--comparar", help="JSON de una corrida anterior")
+        parser.add_argument("--metricas", action="store_true", help="Mide cada operación por dentro y muestra el desglose")
+        parser.add_argument("--perfil", action="store_true", help="Con --metricas, activa además el perfilador por muestreo")
+        parser.add_argument("--procesos", type=int, nargs="+", help="Corre el motor distribuido con estas cantidades de procesos")
+        opciones = parser.parse_args(argumentos[1:])
+        if opciones.procesos:
+            resultados = ejecutar_benchmark_distribuido(opciones.procesos, opciones.operaciones, opciones.escenario, opciones.semilla)
+            print(f"Núcleos disponibles: {resultados['nucleos']}")
+            for n, datos in resultados["procesos"].items():
+                print(f" - {n} procesos: {datos['operaciones_por_segundo']:.0f} operaciones/s (x{datos['aceleracion']:.2f}), "
+                      f"carga {datos['carga_s']:.1f} s, {datos['fallos']} fallos")
+            with open(opciones.salida, "w") as archivo:
+                json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+            return
+        if opciones.metricas:
+            METRICAS.activar()
+            if opciones.perfil:
+                METRICAS.iniciar_perfilador()
+        resultados = ejecutar_benchmark(opciones.operaciones, escenario=opciones.escenario, semilla=opciones.semilla, salida=opciones.salida)
+        print(f"{resultados['operaciones_por_segundo']:.0f} operaciones/s")
+        for nombre, datos in resultados["operaciones"].items():
+            print(f" - {nombre}: {datos['por_segundo']:.0f}/s p50 {datos['p50_ms']:.3f} ms p95 {datos['p95_ms']:.3f} ms p99 {datos['p99_ms']:.3f} ms")
+        if opciones.comparar:
+            print(json.dumps(comparar_benchmarks(opciones.comparar, opciones.salida), indent=2))
+        if opciones.metricas:
+            METRICAS.detener_perfilador()
+            print(METRICAS.exportar())
+        return
+    cine = abrir_cine()
+    try:
+        if argumentos[:1] == ["servidor"]:
+            try:
+                asyncio.run(servir(cine, puerto=int(argumentos[1]) if len(argumentos) > 1 else 8765))
+            except KeyboardInterrupt:
+                pass
+        else:
+            admin = Administrador("Admin", "A001", "admin@cine.com")
+            cliente = cine.clientes.get("cliente@example.com") or Cliente("Cliente Ejemplo", "cliente@example.com")
+            menu_principal(cine, admin, cliente)
+    finally:
+        cine.bitacora.cerrar()
+
+def menu_principal(cine, admin, cliente):
     while True:
         print("\nSistema de Cine: 1. Admin 2. Cliente 3. Salir")
         opcion = input("Elige: ")
@@ -0,0 +1,87 @@
+import importlib.util
+import os
+import random
+import sys
+import threading
+from datetime import datetime, timedelta
+
+# "Gestion de cine.py" no es un nombre de módulo importable: se carga por ruta
+_ruta = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Gestion de cine.py")
+_spec = importlib.util.spec_from_file_location("gestion_de_cine", _ruta)
+cine_mod = importlib.util.module_from_spec(_spec)
+sys.modules["gestion_de_cine"] = cine_mod
+_spec.loader.exec_module(cine_mod)
+
+
+def _preparar(funciones=6, filas=4, columnas=6):
+    cine = cine_mod.Cine("Estrés")
+    pelicula = cine_mod.Pelicula("Estreno", "Acción", 100, "PG", "Póster", 5, 80)
+    inicio = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    horarios = []
+    for n in range(funciones):
+        sala = cine_mod.Sala(n + 1, filas, columnas)
+        cine.agregar_sala(sala)
+        horario = inicio + timedelta(minutes=10 * n)  # una película no puede tener dos funciones a la misma hora
+        cine.agregar_funcion(pelicula, horario, sala)
+        horarios.append((horario, sala))
+    return cine, pelicula, horarios
+
+
+def _comprobar(cine, horarios):
+    # Cada mapa tiene que coincidir con las filas activas del libro: nada ocupado sin boleto y ningún asiento en dos boletos
+    for horario, sala in horarios:
+        funcion = next(f for f in cine.funciones if f.sala is sala and f.horario == horario)
+        vendidos = [i for fila in cine.ventas.por_funcion.get(funcion.id, ()) if cine.ventas.activo[fila]
+                    for i in cine.ventas.indices(fila)]
+        assert len(vendidos) == len(set(vendidos)), f"Asiento vendido dos veces en la sala {sala.numero}"
+        mapa = sala.mapa_asientos(horario)
+        ocupados = {i for i, estado in enumerate(mapa) if estado != cine_mod.LIBRE}
+        assert ocupados == set(vendidos), f"El mapa de la sala {sala.numero} no coincide con el libro"
+        assert sala.ocupados[horario] == len(vendidos)
+
+
+def test_sin_doble_venta_con_muchos_hilos(hilos=16, operaciones=3000):
+    cine, pelicula, horarios = _preparar()
+    vendidos, candado = [], threading.Lock()
+    intervalo = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # cambios de hilo lo más seguido posible para forzar intercalados
+
+    def trabajar(n):
+        azar = random.Random(n)
+        cliente = cine_mod.Cliente(f"Cliente {n}", f"cliente{n}@estres.com")
+        for _ in range(operaciones):
+            horario, sala = azar.choice(horarios)
+            if azar.random() < 0.6:
+                fila = azar.randrange(sala.filas)
+                desde = azar.randrange(sala.columnas - 1)
+                asientos = [f"{sala.nombre_fila(fila)}{c + 1}" for c in range(desde, min(sala.columnas, desde + azar.randint(1, 3)))]
+                try:
+                    boleto = cine.vender_boleto(cliente, pelicula, horario, asientos, azar.random() < 0.3)
+                except ValueError:
+                    continue
+                with candado:
+                    vendidos.append(boleto.codigo)
+            else:
+                with candado:
+                    codigo = azar.choice(vendidos) if vendidos else None
+                if codigo:
+                    try:
+                        # Cancelaciones repetidas del mismo código a propósito: solo una puede liberar
+                        cine.cancelar_boleto(codigo)
+                    except ValueError:
+                        pass
+
+    try:
+        trabajadores = [threading.Thread(target=trabajar, args=(n,)) for n in range(hilos)]
+        for t in trabajadores:
+            t.start()
+        for t in trabajadores:
+            t.join()
+    finally:
+        sys.setswitchinterval(intervalo)
+    _comprobar(cine, horarios)
+
+
+if __name__ == "__main__":
+    test_sin_doble_venta_con_muchos_hilos()
+    print("Sin dobles ventas.")
@@ -0,0 +1,125 @@
+import importlib.util
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+# "Gestion de cine.py" no es un nombre de módulo importable: se carga por ruta
+_ruta = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Gestion de cine.py")
+_spec = importlib.util.spec_from_file_location("gestion_de_cine", _ruta)
+cine_mod = importlib.util.module_from_spec(_spec)
+sys.modules["gestion_de_cine"] = cine_mod
+_spec.loader.exec_module(cine_mod)
+
+
+def _preparar(directorio):
+    cine = cine_mod.Cine("Recuperación")
+    pelicula = cine_mod.Pelicula("Estreno", "Acción", 100, "PG", "Póster", 5, 80)
+    inicio = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    horarios = []
+    for n in range(2):
+        sala = cine_mod.Sala(n + 1, 4, 6, "Centro")
+        cine.agregar_sala(sala)
+        cine.agregar_funcion(pelicula, inicio + timedelta(hours=3 * n), sala)
+        horarios.append(inicio + timedelta(hours=3 * n))
+    cine.activar_bitacora(directorio)
+    return cine, pelicula, horarios
+
+
+def _estado(cine):
+    boletos = sorted((b.codigo, b.horario, tuple(b.asientos), b.cliente.correo, b.coleccionable, b.total) for b in cine.ventas)
+    mapas = {(f.sala.numero, f.horario): (bytes(f.sala.mapa_asientos(f.horario)), f.sala.ocupados[f.horario]) for f in cine.funciones}
+    return boletos, mapas, cine.generar_reporte(), cine.inventario.disponibles("Estreno", "Centro")
+
+
+def _recuperar(cine, directorio):
+    cine.bitacora.cerrar()
+    recuperado = cine_mod.Cine.recuperar(directorio, cine.nombre)
+    recuperado.bitacora.cerrar()
+    return recuperado
+
+
+def test_recupera_ventas_cancelaciones_e_inventario(tmp_path):
+    directorio = str(tmp_path / "bitacora")
+    cine, pelicula, horarios = _preparar(directorio)
+    cine.abastecer_coleccionable(pelicula, 10, "Centro")
+    cliente = cine_mod.Cliente("Ana", "ana@cine.com")
+    boletos = [cine.vender_boleto(cliente, pelicula, horarios[0], ["A1", "A2"], True),
+               cine.vender_boleto(cliente, pelicula, horarios[1], ["B3"], True),
+               cine.vender_boleto(cliente, pelicula, horarios[0], ["C4"])]
+    cine.cancelar_boleto(boletos[0].codigo)
+    cine.guardar_instantanea()
+    # Parte del estado queda en la instantánea y parte solo en la bitácora
+    cine.cancelar_boleto(boletos[1].codigo)
+    cine.vender_boleto(cliente, pelicula, horarios[1], ["D1", "D2"], True)
+    esperado = _estado(cine)
+    recuperado = _recuperar(cine, directorio)
+    assert _estado(recuperado) == esperado
+    assert not recuperado.ventas.buscar(boletos[0].codigo)
+
+
+def test_instantanea_no_corta_una_cancelacion(tmp_path):
+    directorio = str(tmp_path / "bitacora")
+    cine, pelicula, horarios = _preparar(directorio)
+    boleto = cine.vender_boleto(cine_mod.Cliente("Ana", "ana@cine.com"), pelicula, horarios[0], ["A1", "A2"])
+    # La cancelación se detiene justo después de anotarse y antes de liberar los asientos
+    dentro, seguir, registrar = threading.Event(), threading.Event(), cine.reporte.registrar
+
+    def registrar_y_esperar(*args):
+        dentro.set()
+        seguir.wait(5)
+        return registrar(*args)
+
+    cine.reporte.registrar = registrar_y_esperar
+    cancelacion = threading.Thread(target=cine.cancelar_boleto, args=(boleto.codigo,))
+    cancelacion.start()
+    assert dentro.wait(5)
+    instantanea = threading.Thread(target=cine.guardar_instantanea)
+    instantanea.start()
+    instantanea.join(0.2)
+    assert instantanea.is_alive(), "La instantánea no esperó a que la cancelación liberara los asientos"
+    seguir.set()
+    cancelacion.join()
+    instantanea.join()
+    esperado = _estado(cine)
+    recuperado = _recuperar(cine, directorio)
+    assert _estado(recuperado) == esperado
+    funcion = next(f for f in recuperado.funciones if f.horario == horarios[0])
+    assert funcion.sala.ocupados[horarios[0]] == 0 and not recuperado.ventas
+
+
+def test_instantanea_no_corta_un_abastecimiento(tmp_path):
+    directorio = str(tmp_path / "bitacora")
+    cine, pelicula, horarios = _preparar(directorio)
+    # El contador ya sumó las unidades y el registro INVENTARIO todavía no se anotó
+    dentro, seguir, anotar = threading.Event(), threading.Event(), cine._anotar
+
+    def anotar_tras_esperar(tipo, contenido):
+        if tipo == cine_mod.INVENTARIO:
+            dentro.set()
+            seguir.wait(5)
+        return anotar(tipo, contenido)
+
+    cine._anotar = anotar_tras_esperar
+    abastecimiento = threading.Thread(target=cine.abastecer_coleccionable, args=(pelicula, 10, "Centro"))
+    abastecimiento.start()
+    assert dentro.wait(5)
+    instantanea = threading.Thread(target=cine.guardar_instantanea)
+    instantanea.start()
+    instantanea.join(0.2)
+    assert instantanea.is_alive(), "La instantánea no esperó a que se anotara el abastecimiento"
+    seguir.set()
+    abastecimiento.join()
+    instantanea.join()
+    recuperado = _recuperar(cine, directorio)
+    assert recuperado.inventario.disponibles("Estreno", "Centro") == cine.inventario.disponibles("Estreno", "Centro") == 10
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+    for prueba in (test_recupera_ventas_cancelaciones_e_inventario, test_instantanea_no_corta_una_cancelacion,
+                   test_instantanea_no_corta_un_abastecimiento):
+        with tempfile.TemporaryDirectory() as temporal:
+            prueba(Path(temporal))
+    print("Recuperación correcta.")